@@ -0,0 +1,83 @@
+import json
+import os
+from fastapi import FastAPI, File, Form, HTTPException, UploadFile
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from core.agent import get_mcq_agent
+from core.cache import hash_bytes
+from core.config import MAX_PDF_SIZE_MB, PERSIST_UPLOADS
+from core.telemetry import render_metrics
+from services.job_service import JobQueueFull, job_manager
+
+UPLOAD_DIR = "uploads"
+if PERSIST_UPLOADS:
+    os.makedirs(UPLOAD_DIR, exist_ok=True)
+
+app = FastAPI(title="MCQ Agent API")
+
+@app.on_event("startup")
+def warm_up_agent():
+    get_mcq_agent()
+
+@app.get("/health")
+def health():
+    return {"status": "ok"}
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    # Prometheus text exposition format
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+# A plain def, so reading, hashing and saving a large upload runs on the threadpool instead of the event loop
+@app.post("/jobs", status_code=202)
+def create_job(file: UploadFile = File(...), num_questions: int = Form(10), regenerate: bool = Form(False)):
+    if not 1 <= num_questions <= 100:
+        raise HTTPException(status_code=422, detail="num_questions must be between 1 and 100")
+
+    content = file.file.read()
+    file_size_mb = len(content) / (1024 * 1024)
+    if file_size_mb > MAX_PDF_SIZE_MB:
+        raise HTTPException(
+            status_code=413,
+            detail=f"File too large: {file_size_mb:.2f}MB (Max: {MAX_PDF_SIZE_MB:g}MB)"
+        )
+
+    file_hash = hash_bytes(content)
+    if PERSIST_UPLOADS:
+        safe_name = "".join([c for c in (file.filename or "upload.pdf") if c.isalpha() or c.isdigit() or c in (' ', '.', '_')]).rstrip()
+        save_path = os.path.join(UPLOAD_DIR, f"{file_hash[:16]}_{safe_name}")
+        if not os.path.exists(save_path):
+            with open(save_path, "wb") as f:
+                f.write(content)
+
+    try:
+        # The job reads the upload from memory, the saved copy is only kept for reference
+        job = job_manager.submit(content, num_questions, dedupe_key=(file_hash, num_questions), regenerate=regenerate)
+    except JobQueueFull as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": "10"})
+
+    return {"job_id": job.id, "status": job.status}
+
+def _get_job(job_id: str):
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job not found: {job_id}")
+    return job
+
+@app.get("/jobs/{job_id}")
+def get_job(job_id: str):
+    return _get_job(job_id).to_dict()
+
+# Async all the way, so open streams wait on the event loop instead of holding threadpool workers
+@app.get("/jobs/{job_id}/stream")
+async def stream_job(job_id: str):
+    job = _get_job(job_id)
+
+    async def sse():
+        async for event in job.aiter_events():
+            if event is None:
+                yield ": keep-alive\n\n"
+                continue
+            yield f"event: {event['type']}\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
+        yield f"event: end\ndata: {json.dumps({'status': job.status, 'error': job.error})}\n\n"
+
+    return StreamingResponse(sse(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
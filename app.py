@@ -1,10 +1,14 @@
 import streamlit as st
 import os
-from services.mcq_service import generate_mcqs_from_pdf
+from services.job_service import JobQueueFull, job_manager
+from core.agent import get_mcq_agent
+from core.cache import hash_bytes
+from core.config import MAX_PDF_SIZE_MB, PERSIST_UPLOADS
 import time
 
 UPLOAD_DIR = "uploads"
-os.makedirs(UPLOAD_DIR, exist_ok=True)
+if PERSIST_UPLOADS:
+    os.makedirs(UPLOAD_DIR, exist_ok=True)
 
 st.set_page_config(
     page_title="MCQ Agent",
@@ -144,6 +148,35 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
+@st.cache_resource
+def warm_up_agent():
+    # Build the shared agent and HTTP pool once per server process, not on the first click
+    return get_mcq_agent()
+
+warm_up_agent()
+
+def format_seconds(seconds):
+    if seconds is None:
+        return "estimating..."
+    minutes, seconds = divmod(int(seconds), 60)
+    return f"{minutes}m {seconds:02d}s" if minutes else f"{seconds}s"
+
+def render_job_progress(job):
+    progress = job.progress or {}
+    planned_chunks = progress.get("planned_chunks") or progress.get("num_chunks") or 0
+    completed_chunks = progress.get("completed_chunks", 0)
+
+    if planned_chunks:
+        st.progress(min(1.0, completed_chunks / planned_chunks))
+        st.markdown(f"**Chunk {completed_chunks}/{planned_chunks}**")
+    else:
+        st.progress(0.0)
+        st.markdown(f"**{job.status.capitalize()}...**")
+    st.caption(
+        f"{len(job.questions)}/{job.num_questions} questions ready · "
+        f"elapsed {format_seconds(job.elapsed_seconds)} · ETA {format_seconds(job.eta_seconds)}"
+    )
+
 def init_session_state():
     if 'quiz_data' not in st.session_state:
         st.session_state.quiz_data = None
@@ -153,14 +186,25 @@ def init_session_state():
         st.session_state.user_answers = {}
     if 'quiz_submitted' not in st.session_state:
         st.session_state.quiz_submitted = False
+    if 'job_id' not in st.session_state:
+        st.session_state.job_id = None
 
 init_session_state()
 
+# Generation runs in the shared job manager, this session only keeps the job id
+job = job_manager.get(st.session_state.job_id) if st.session_state.job_id else None
+if job is not None:
+    if job.questions:
+        st.session_state.quiz_data = job.to_dict()
+    if job.finished:
+        # Keep the final snapshot in the session, the job itself expires from the manager
+        st.session_state.job_id = None
+
 # Header
 st.markdown('<h1 class="main-header">📝 MCQ Agent</h1>', unsafe_allow_html=True)
 
 # Upload Section
-if not st.session_state.quiz_data:
+if not st.session_state.quiz_data and job is None:
     st.markdown("---")
     
     # Number of questions
@@ -172,59 +216,80 @@ if not st.session_state.quiz_data:
         step=1
     )
     
+    # Same PDF and count would otherwise come back from the cache
+    regenerate = st.checkbox(
+        "Generate new questions",
+        help="Skip cached questions for this PDF and ask the model again"
+    )
+    
     st.markdown("")
     
     # PDF upload
     uploaded_file = st.file_uploader(
-        "Upload PDF (Max 10MB)",
+        f"Upload PDF (Max {MAX_PDF_SIZE_MB:g}MB)",
         type=['pdf'],
-        help="Maximum file size: 10MB"
+        help=f"Maximum file size: {MAX_PDF_SIZE_MB:g}MB"
     )
     
     if uploaded_file:
         file_size_mb = uploaded_file.size / (1024 * 1024)
         
-        if file_size_mb > 10:
-            st.error(f"File too large: {file_size_mb:.2f}MB (Max: 10MB)")
+        if file_size_mb > MAX_PDF_SIZE_MB:
+            st.error(f"File too large: {file_size_mb:.2f}MB (Max: {MAX_PDF_SIZE_MB:g}MB)")
         else:
             st.info(f"📄 {uploaded_file.name} ({file_size_mb:.2f}MB)")
             
             if st.button("Generate Quiz"):
-                safe_name = "".join([c for c in uploaded_file.name if c.isalpha() or c.isdigit() or c in (' ', '.', '_')]).rstrip()
-                file_id = f"{int(time.time())}_{safe_name}"
-                save_path = os.path.join(UPLOAD_DIR, file_id)
+                # The job reads the upload buffer in place, without a copy or a disk round trip
+                pdf_buffer = uploaded_file.getbuffer()
+                file_hash = hash_bytes(pdf_buffer)
                 
-                # Save file
-                with open(save_path, "wb") as f:
-                    f.write(uploaded_file.getbuffer())
+                # Optionally keep a copy, once per content, re-uploads reuse the existing one
+                if PERSIST_UPLOADS:
+                    safe_name = "".join([c for c in uploaded_file.name if c.isalpha() or c.isdigit() or c in (' ', '.', '_')]).rstrip()
+                    save_path = os.path.join(UPLOAD_DIR, f"{file_hash[:16]}_{safe_name}")
+                    if not os.path.exists(save_path):
+                        with open(save_path, "wb") as f:
+                            f.write(pdf_buffer)
                 
+                # A second click, or a refresh, on the same PDF attaches to the running job
                 try:
-                    with st.spinner("Generating questions..."):
-                        result = generate_mcqs_from_pdf(
-                            pdf_path=save_path,
-                            num_questions=num_questions
-                        )
-                        
-                        st.session_state.quiz_data = result
-                        st.success(f"✓ Generated {len(result['questions'])} questions")
-                        st.rerun()
-                
-                except Exception as e:
+                    job = job_manager.submit(
+                        pdf_buffer,
+                        num_questions,
+                        dedupe_key=(file_hash, num_questions),
+                        regenerate=regenerate
+                    )
+                    st.session_state.job_id = job.id
+                    st.rerun()
+                except JobQueueFull as e:
                     st.error(f"Error: {str(e)}")
-                    # Delete if there was an error!
-                    if os.path.exists(save_path):
-                        os.unlink(save_path)
+
+# Generation Progress (until the first question is ready)
+elif not st.session_state.quiz_data:
+    st.markdown("---")
+    render_job_progress(job)
+
+    if job.finished:
+        st.error(f"Error: {job.error or 'No questions could be generated'}")
+        if st.button("Try Again"):
+            st.rerun()
+    else:
+        time.sleep(1)
+        st.rerun()
 
 # Quiz Interface
 elif st.session_state.quiz_data and not st.session_state.quiz_submitted:
     questions = st.session_state.quiz_data['questions']
+    generating = st.session_state.quiz_data['status'] in ("queued", "running")
+    total_questions = st.session_state.quiz_data['num_questions'] if generating else len(questions)
     current_q = st.session_state.current_question
     question = questions[current_q]
     
     # Progress
-    progress = (current_q + 1) / len(questions)
+    progress = (current_q + 1) / total_questions
     st.progress(progress)
-    st.markdown(f"**Question {current_q + 1} of {len(questions)}**")
+    st.markdown(f"**Question {current_q + 1} of {total_questions}**")
     
     # Question
     st.markdown(f"""
@@ -277,6 +342,13 @@ elif st.session_state.quiz_data and not st.session_state.quiz_submitted:
             if st.button("Next →"):
                 st.session_state.current_question += 1
                 st.rerun()
+        elif generating:
+            eta = format_seconds(st.session_state.quiz_data['eta_seconds'])
+            st.caption(f"⏳ Generating more questions ({len(questions)}/{total_questions} ready, ETA {eta})...")
+            # Keep polling once this one is answered so "Next" shows up when the next question lands
+            if user_answer:
+                time.sleep(1)
+                st.rerun()
         else:
             if st.button("Finish"):
                 st.session_state.quiz_submitted = True
@@ -325,6 +397,7 @@ elif st.session_state.quiz_submitted:
     st.markdown("---")
     if st.button("New Quiz"):
         st.session_state.quiz_data = None
+        st.session_state.job_id = None
         st.session_state.current_question = 0
         st.session_state.user_answers = {}
         st.session_state.quiz_submitted = False
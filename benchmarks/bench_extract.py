@@ -0,0 +1,42 @@
+"""Serial vs process-pool page extraction.
+
+Run from the repo root:
+
+    python -m benchmarks.bench_extract [--workers 4] [--repeat 3]
+"""
+import argparse
+import os
+import time
+from pypdf import PdfReader
+from core.pdf_processor import extract_text_from_pdf
+
+DOCS = ["docs/bitcoin.pdf", "docs/before-the-coffee-gets-cold.pdf"]
+
+def best_of(repeat: int, fn, *args, **kwargs):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn(*args, **kwargs)
+        timings.append(time.perf_counter() - start)
+    return min(timings), result
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("docs", nargs="*", default=DOCS)
+    args = parser.parse_args()
+
+    print(f"{'document':<40} {'pages':>5} {'serial':>9} {'parallel':>9} {'speedup':>8}")
+    for doc in args.docs:
+        num_pages = len(PdfReader(doc).pages)
+        serial_time, serial_text = best_of(args.repeat, extract_text_from_pdf, doc, workers=1)
+        parallel_time, parallel_text = best_of(args.repeat, extract_text_from_pdf, doc, workers=args.workers)
+        assert serial_text == parallel_text, f"{doc}: parallel output differs from serial"
+        print(
+            f"{os.path.basename(doc):<40} {num_pages:>5} "
+            f"{serial_time:>8.2f}s {parallel_time:>8.2f}s {serial_time / parallel_time:>7.2f}x"
+        )
+
+if __name__ == "__main__":
+    main()
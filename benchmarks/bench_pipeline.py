@@ -0,0 +1,103 @@
+"""End-to-end pipeline benchmark against the local OpenAI stub, no network needed.
+
+Runs generate_mcqs_from_pdf over the PDFs in docs/ with caches bypassed and
+reports per-stage timings (validate, extract, chunk, LLM, track), throughput
+in documents/min at the requested document concurrency, and peak memory.
+
+    python -m benchmarks.bench_pipeline --documents 8 --concurrency 2 --latency 0.8 --jitter 0.3
+    python -m benchmarks.bench_pipeline --replay recordings.jsonl
+
+Caches and usage stats are written to a temporary directory so ./data is untouched.
+"""
+import argparse
+import glob
+import os
+import resource
+import statistics
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from benchmarks.stub_openai import add_stub_arguments, start_stub, stub_config_from_args
+
+STAGES = ["validate", "extract", "chunk", "llm", "track"]
+
+def stage_samples(results):
+    # Per-stage durations in seconds, from the spans each run records in its metadata
+    samples = {stage: [] for stage in STAGES}
+    for result in results:
+        for recorded in result["metadata"].get("spans", []):
+            samples.setdefault(recorded["name"], []).append(recorded["duration_ms"] / 1000)
+    return samples
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("docs", nargs="*", default=sorted(glob.glob("docs/*.pdf")))
+    parser.add_argument("--documents", type=int, default=4, help="Documents to process, cycling over the inputs")
+    parser.add_argument("--questions", type=int, default=10)
+    parser.add_argument("--concurrency", type=int, default=2, help="Documents processed in parallel")
+    parser.add_argument("--chunk-concurrency", type=int, default=4, help="LLM calls in flight per document")
+    parser.add_argument("--trace-memory", action="store_true", help="Also report the Python heap peak via tracemalloc (slower)")
+    add_stub_arguments(parser)
+    args = parser.parse_args()
+
+    docs = [os.path.abspath(doc) for doc in args.docs]
+    server, base_url = start_stub(stub_config_from_args(args))
+    os.environ["OPENAI_BASE_URL"] = base_url
+    os.environ.setdefault("OPENAI_API_KEY", "stub")
+    os.chdir(tempfile.mkdtemp(prefix="mcq-bench-"))
+
+    # Imported only after OPENAI_BASE_URL points at the stub, settings are read at import
+    from services.mcq_service import generate_mcqs_from_pdf
+    from core.tracker import tracker
+
+    if args.trace_memory:
+        tracemalloc.start()
+
+    def run(doc):
+        return generate_mcqs_from_pdf(
+            doc, args.questions, max_concurrency=args.chunk_concurrency,
+            use_cache=False, use_chunk_cache=False, use_text_cache=False
+        )
+
+    jobs = [docs[i % len(docs)] for i in range(args.documents)]
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        results = list(pool.map(run, jobs))
+    wall = time.perf_counter() - start
+    tracker.flush()
+
+    print("\n" + "=" * 80)
+    print(f"{len(jobs)} documents, {args.questions} questions each, concurrency {args.concurrency}x{args.chunk_concurrency}")
+    print(f"stub: latency {args.latency}s ±{args.jitter}s, error rate {args.error_rate:.0%}, {server.stats}")
+    print("=" * 80)
+    print(f"{'stage':<10} {'calls':>6} {'total s':>9} {'mean ms':>9} {'p50 ms':>9} {'p95 ms':>9}")
+    for stage, samples in stage_samples(results).items():
+        print(
+            f"{stage:<10} {len(samples):>6} {sum(samples):>9.2f} "
+            f"{(statistics.mean(samples) if samples else 0) * 1000:>9.1f} "
+            f"{percentile(samples, 0.5) * 1000:>9.1f} {percentile(samples, 0.95) * 1000:>9.1f}"
+        )
+
+    questions = sum(len(result["questions"]) for result in results)
+    print(f"\nwall time:   {wall:.2f}s")
+    print(f"throughput:  {len(jobs) / wall * 60:.1f} documents/min, {questions / wall:.1f} questions/s")
+    print(f"questions:   {questions}/{len(jobs) * args.questions}")
+    summary = tracker.get_summary()
+    tokens = summary["tokens"]
+    print(
+        f"tokens:      {tokens['input']} in ({tokens['cached_input']} from prompt cache), {tokens['output']} out, "
+        f"est. ${summary['costs']['total_usd_est']:.4f} (prompt cache saved ${summary['costs']['prompt_cache_savings_usd_est']:.4f})"
+    )
+    print(f"peak RSS:    {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.1f} MB")
+    if args.trace_memory:
+        print(f"peak heap:   {tracemalloc.get_traced_memory()[1] / (1024 * 1024):.1f} MB")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+"""Per-call token counting overhead: tiktoken lookup per call vs the cached registry.
+
+Run from the repo root (needs the tiktoken encoding files, downloaded on first use):
+
+    python -m benchmarks.bench_tokenizer [--calls 2000] [--doc docs/bitcoin.pdf]
+"""
+import argparse
+import time
+import tiktoken
+from core.pdf_processor import chunk_text, extract_text_from_pdf
+from core.tokenizer import count_tokens, count_tokens_batch, get_encoding
+
+MODEL = "gpt-4o"
+
+def uncached_count(text: str, model: str = MODEL) -> int:
+    # What count_tokens_manually used to do on every call
+    try:
+        encoding = tiktoken.encoding_for_model(model)
+    except KeyError:
+        encoding = tiktoken.get_encoding("cl100k_base")
+    return len(encoding.encode(text))
+
+def per_call_us(calls: int, fn, *args) -> float:
+    start = time.perf_counter()
+    for _ in range(calls):
+        fn(*args)
+    return (time.perf_counter() - start) / calls * 1_000_000
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=2000)
+    parser.add_argument("--doc", default="docs/bitcoin.pdf")
+    args = parser.parse_args()
+
+    get_encoding(MODEL)  # load the BPE file outside the timings
+
+    print("Overhead on a short string (lookup cost dominates):")
+    short = "What is the main idea of this paragraph?"
+    before = per_call_us(args.calls, uncached_count, short)
+    after = per_call_us(args.calls, count_tokens, short)
+    print(f"  encoding_for_model per call: {before:8.1f} µs")
+    print(f"  cached registry:             {after:8.1f} µs  ({before / after:.1f}x)")
+
+    chunks = [c.text if hasattr(c, 'text') else str(c) for c in chunk_text(extract_text_from_pdf(args.doc))]
+    print(f"\nCounting {len(chunks)} chunks of {args.doc}:")
+    rounds = max(1, args.calls // 100)
+    loop = per_call_us(rounds, lambda: [uncached_count(c) for c in chunks])
+    cached = per_call_us(rounds, lambda: [count_tokens(c) for c in chunks])
+    batch = per_call_us(rounds, count_tokens_batch, chunks)
+    assert [uncached_count(c) for c in chunks] == count_tokens_batch(chunks)
+    print(f"  uncached loop:  {loop / 1000:8.2f} ms")
+    print(f"  cached loop:    {cached / 1000:8.2f} ms  ({loop / cached:.1f}x)")
+    print(f"  batch:          {batch / 1000:8.2f} ms  ({loop / batch:.1f}x)")
+
+if __name__ == "__main__":
+    main()
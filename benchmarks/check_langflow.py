@@ -0,0 +1,135 @@
+"""Behaviour checks for the Langflow clients against the local stand-in, no network needed.
+
+Starts benchmarks.stub_langflow on a free port and checks that:
+
+- a PDF is uploaded once per server, whether it is passed as a path, bytes or
+  a stream, and whichever client sends it
+- a file the server lost is uploaded again after the run that found it missing
+- flow runs answered with 503 are retried, while a gateway 504 and a read
+  timeout are not, since the server may already be running the flow
+- the async client uploads, runs flows and shares the upload map
+
+    python -m benchmarks.check_langflow
+    python -m benchmarks.check_langflow docs/bitcoin.pdf
+
+Exits non-zero on the first failed check.
+"""
+import argparse
+import asyncio
+import io
+import os
+import time
+from benchmarks.stub_langflow import LangflowStubConfig, start_langflow_stub
+
+def check(name: str, condition: bool, detail: str = ""):
+    if not condition:
+        raise SystemExit(f"✗ {name}{f': {detail}' if detail else ''}")
+    print(f"✓ {name}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("pdf", nargs="?", default="docs/bitcoin.pdf")
+    args = parser.parse_args()
+
+    os.environ.setdefault("OPENAI_API_KEY", "stub")
+    # Imported only after OPENAI_API_KEY is set, settings are read at import
+    import httpx
+    from services.langflow_service import AsyncLangflowClient, LangflowClient, parse_flow_questions
+
+    with open(args.pdf, "rb") as f:
+        data = f.read()
+
+    # Uploads: one per content hash, across input types and clients
+    server, url = start_langflow_stub(LangflowStubConfig(latency=0.05, jitter=0.0))
+    client = LangflowClient(base_url=url, max_retries=0)
+    paths = {client.upload_pdf(args.pdf), client.upload_pdf(data), client.upload_pdf(io.BytesIO(data))}
+    check("upload deduplicated across path, bytes and stream", server.stats.uploads == 1, f"{server.stats}")
+    check("one server path per document", len(paths) == 1, f"{paths}")
+    client.upload_pdf(data + b"\n")
+    check("changed content is uploaded again", server.stats.uploads == 2, f"{server.stats}")
+
+    async def run_async():
+        async with AsyncLangflowClient(base_url=url, max_retries=0) as async_client:
+            server_path = await async_client.upload_pdf(data)
+            contents = await asyncio.gather(*(async_client.run_flow(server_path, 3) for _ in range(4)))
+        return server_path, contents
+
+    runs_before = server.stats.runs
+    server_path, contents = asyncio.run(run_async())
+    check("async client reuses the sync client's upload", server.stats.uploads == 2 and server_path in paths)
+    check(
+        "async client runs flows concurrently",
+        server.stats.runs - runs_before == 4 and all(len(parse_flow_questions(content)) == 3 for content in contents)
+    )
+
+    # Uploads are remembered per server, and forgotten once the server loses the file
+    other_server, other_url = start_langflow_stub(LangflowStubConfig(latency=0.05, jitter=0.0))
+    other_client = LangflowClient(base_url=other_url, max_retries=0)
+    check("another server gets its own upload", other_client.upload_pdf(data) in paths and other_server.stats.uploads == 1)
+    other_client.close()
+    other_server.shutdown()
+
+    server.files.clear()
+    runs_before = server.stats.runs
+    try:
+        client.run_flow(server_path, 2)
+        raised = None
+    except httpx.HTTPStatusError as e:
+        raised = e.response.status_code
+    check("run on a lost file fails without retrying", raised == 404 and server.stats.runs - runs_before == 1)
+    server_path = client.upload_pdf(data)
+    questions = parse_flow_questions(client.run_flow(server_path, 2))
+    check("lost file uploaded again", server.stats.uploads == 3 and len(questions) == 2, f"{server.stats}")
+    client.close()
+    server.shutdown()
+
+    # Retries: the first two runs get 503, the third succeeds
+    server, url = start_langflow_stub(LangflowStubConfig(latency=0.05, jitter=0.0, fail_first=2))
+    client = LangflowClient(base_url=url, max_retries=2)
+    questions = parse_flow_questions(client.run_flow(client.upload_pdf(data), 2))
+    check("503 retried until the run succeeds", server.stats.runs == 3 and len(questions) == 2, f"{server.stats}")
+    client.close()
+    server.shutdown()
+
+    server, url = start_langflow_stub(LangflowStubConfig(latency=0.05, jitter=0.0, fail_first=5))
+    client = LangflowClient(base_url=url, max_retries=1)
+    try:
+        client.run_flow(client.upload_pdf(data), 2)
+        raised = None
+    except httpx.HTTPStatusError as e:
+        raised = e.response.status_code
+    check("503 raised once retries run out", raised == 503 and server.stats.runs == 2, f"{raised}, {server.stats}")
+    client.close()
+    server.shutdown()
+
+    server, url = start_langflow_stub(LangflowStubConfig(latency=0.05, jitter=0.0, fail_first=1, fail_status=504))
+    client = LangflowClient(base_url=url, max_retries=3)
+    try:
+        client.run_flow(client.upload_pdf(data), 2)
+        raised = None
+    except httpx.HTTPStatusError as e:
+        raised = e.response.status_code
+    check("gateway 504 on a run not retried", raised == 504 and server.stats.runs == 1, f"{raised}, {server.stats}")
+    client.close()
+    server.shutdown()
+
+    # Read timeout: the flow may already be running, so it is never sent twice
+    server, url = start_langflow_stub(LangflowStubConfig(latency=1.0, jitter=0.0))
+    client = LangflowClient(base_url=url, read_timeout=0.3, max_retries=3)
+    server_path = client.upload_pdf(data)
+    started = time.perf_counter()
+    try:
+        client.run_flow(server_path, 2)
+        raised = None
+    except httpx.ReadTimeout as e:
+        raised = e
+    elapsed = time.perf_counter() - started
+    check("read timeout raised without retrying", raised is not None and server.stats.runs == 1, f"{server.stats}")
+    check("read timeout surfaces promptly", elapsed < 1.0, f"{elapsed:.2f}s")
+    client.close()
+    server.shutdown()
+
+    print("\nAll Langflow client checks passed")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+"""Local stand-in for the two Langflow endpoints the app calls.
+
+Serves POST /api/v2/files (multipart upload, answers with the stored file's
+`path`) and POST /api/v1/run/<flow id> (answers with canned MCQList JSON as the
+chat message content, for the count in the "Generate N questions" input).
+Runs naming a file the stub does not hold are answered with 404, like a
+server that lost the upload. Latency, jitter and the share of runs answered
+with 503 (or another status for a fixed number of first runs, for
+deterministic retry checks) are configurable, and upload/run counts are
+printed on exit so upload deduplication can be checked.
+
+    python -m benchmarks.stub_langflow --port 7860 --latency 2 --error-rate 0.1
+
+Point the app at it with LANGFLOW_BASE_URL=http://127.0.0.1:7860.
+"""
+import argparse
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional, Tuple
+from benchmarks.stub_openai import canned_questions
+
+COUNT_PATTERN = re.compile(r"Generate (\d+) questions")
+# Stands in for the document text, so canned questions differ between runs
+TOPICS = (
+    "network nodes broadcast transactions blocks chain proof work timestamp server hashing merkle "
+    "incentive reward privacy signatures double spending longest honest attacker probability payment "
+    "verification disk space combining splitting value calculations conclusion majority consensus"
+)
+
+@dataclass
+class LangflowStubConfig:
+    latency: float = 0.5
+    jitter: float = 0.2
+    error_rate: float = 0.0
+    fail_first: int = 0
+    fail_status: int = 503
+    seed: int = 0
+    api_key: Optional[str] = None
+
+@dataclass
+class LangflowStubStats:
+    uploads: int = 0
+    runs: int = 0
+    errors: int = 0
+    lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def bump(self, name: str):
+        with self.lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+def multipart_file(body: bytes, content_type: str) -> bytes:
+    # The first part's payload is enough, the app uploads a single "file" field
+    boundary = content_type.split("boundary=")[-1].strip('"').encode()
+    part = body.split(b"--" + boundary)[1]
+    return part.split(b"\r\n\r\n", 1)[1].rsplit(b"\r\n", 1)[0]
+
+def run_response(body: Dict, serial: int) -> Dict:
+    match = COUNT_PATTERN.search(body.get("input_value", ""))
+    count = int(match.group(1)) if match else 1
+    content = json.dumps(canned_questions(TOPICS, count, serial), ensure_ascii=False)
+    return {
+        "session_id": body.get("session_id"),
+        "outputs": [{
+            "inputs": {"input_value": body.get("input_value")},
+            "outputs": [{"results": {"message": {"data": {"content": content}}}}]
+        }]
+    }
+
+class LangflowStubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address: Tuple[str, int], config: LangflowStubConfig):
+        super().__init__(address, LangflowStubHandler)
+        self.config = config
+        self.stats = LangflowStubStats()
+        self.rng = random.Random(config.seed)
+        self.rng_lock = threading.Lock()
+        self.serial = 0
+        # Paths handed out by uploads, clearing it simulates the server deleting its files
+        self.files = set()
+
+    def next_roll(self) -> Tuple[int, float, float]:
+        with self.rng_lock:
+            self.serial += 1
+            return self.serial, self.rng.random(), self.rng.uniform(-self.config.jitter, self.config.jitter)
+
+class LangflowStubHandler(BaseHTTPRequestHandler):
+    server: LangflowStubServer
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status: int, payload: Dict):
+        data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        config = self.server.config
+        stats = self.server.stats
+        if config.api_key and self.headers.get("x-api-key") != config.api_key:
+            self._send_json(403, {"detail": "Invalid API key (stub)"})
+            return
+
+        if self.path.rstrip("/") == "/api/v2/files":
+            stats.bump("uploads")
+            # Same bytes, same path, like a server that already stored the file
+            file_id = hashlib.sha256(multipart_file(body, self.headers.get("Content-Type", ""))).hexdigest()[:32]
+            self.server.files.add(f"stub/{file_id}.pdf")
+            self._send_json(201, {"id": file_id, "name": "upload", "path": f"stub/{file_id}.pdf", "size": len(body)})
+            return
+
+        if not self.path.startswith("/api/v1/run/"):
+            self._send_json(404, {"detail": f"Unknown path {self.path}"})
+            return
+
+        stats.bump("runs")
+        payload = json.loads(body or b"{}")
+        missing = [
+            path for tweak in payload.get("tweaks", {}).values() if isinstance(tweak, dict)
+            for path in tweak.get("path", []) if path not in self.server.files
+        ]
+        if missing:
+            stats.bump("errors")
+            self._send_json(404, {"detail": f"File not found: {missing[0]} (stub)"})
+            return
+
+        serial, roll, jitter = self.server.next_roll()
+        time.sleep(max(0.0, config.latency + jitter))
+        if serial <= config.fail_first:
+            stats.bump("errors")
+            self._send_json(config.fail_status, {"detail": f"Forced failure {serial}/{config.fail_first} (stub)"})
+            return
+        if roll < config.error_rate:
+            stats.bump("errors")
+            self._send_json(503, {"detail": "Flow temporarily unavailable (stub)"})
+            return
+        self._send_json(200, run_response(payload, serial))
+
+def start_langflow_stub(
+    config: LangflowStubConfig, host: str = "127.0.0.1", port: int = 0
+) -> Tuple[LangflowStubServer, str]:
+    """Start the stub on a background thread and return it with its base URL."""
+    server = LangflowStubServer((host, port), config)
+    threading.Thread(target=server.serve_forever, name="langflow-stub", daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}"
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=7860)
+    parser.add_argument("--latency", type=float, default=0.5, help="Mean seconds per flow run")
+    parser.add_argument("--jitter", type=float, default=0.2, help="Uniform +/- seconds around --latency")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of flow runs answered with 503")
+    parser.add_argument("--fail-first", type=int, default=0, help="Answer the first N flow runs with --fail-status")
+    parser.add_argument("--fail-status", type=int, default=503)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--api-key", help="Reject requests without this x-api-key")
+    args = parser.parse_args()
+
+    config = LangflowStubConfig(
+        latency=args.latency, jitter=args.jitter, error_rate=args.error_rate, fail_first=args.fail_first,
+        fail_status=args.fail_status, seed=args.seed, api_key=args.api_key
+    )
+    server = LangflowStubServer((args.host, args.port), config)
+    print(f"Stub Langflow listening on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(f"Served: {server.stats}")
+
+if __name__ == "__main__":
+    main()
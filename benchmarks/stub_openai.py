@@ -0,0 +1,330 @@
+"""Local OpenAI-compatible stub for offline benchmarks.
+
+Serves POST /v1/chat/completions the way ChatOpenAI.with_structured_output(MCQList)
+calls it: json_schema / json_mode requests get the MCQList JSON back as message
+content, function-calling requests get it as a tool call. Requests for the
+PackedMCQList schema get questions grouped per "[Segment n]" of the prompt.
+Prompt caching is simulated: a request whose prefix up to the question count
+was seen before reports it (in 128-token steps, from 1024 tokens) as
+`prompt_tokens_details.cached_tokens`, like the OpenAI API. Latency, jitter and
+error rates are configurable, and real responses can be recorded once and
+replayed later without network access.
+
+    python -m benchmarks.stub_openai --port 8100 --latency 0.8 --jitter 0.3 --error-rate 0.05
+    python -m benchmarks.stub_openai --record recordings.jsonl --upstream https://api.openai.com/v1
+    python -m benchmarks.stub_openai --replay recordings.jsonl
+
+Point the app at it with OPENAI_BASE_URL=http://127.0.0.1:8100/v1.
+"""
+import argparse
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+import time
+import urllib.error
+import urllib.request
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional, Tuple
+
+COUNT_PATTERN = re.compile(r"Create (\d+) multiple-choice")
+SEGMENT_PATTERN = re.compile(
+    r"\[Segment (\d+)\] Create (\d+) multiple-choice questions from this segment:\n(.*?)(?=\n\n\[Segment \d+\]|\Z)",
+    re.DOTALL
+)
+SEGMENT_START = "[Segment 1]"
+CACHE_MIN_TOKENS = 1024
+CACHE_INCREMENT_TOKENS = 128
+WORD_PATTERN = re.compile(r"[^\W\d_]{5,}", re.UNICODE)
+
+@dataclass
+class StubConfig:
+    latency: float = 0.5
+    jitter: float = 0.2
+    error_rate: float = 0.0
+    seed: int = 0
+    record: Optional[str] = None
+    replay: Optional[str] = None
+    upstream: str = "https://api.openai.com/v1"
+    upstream_api_key: Optional[str] = None
+
+@dataclass
+class StubStats:
+    requests: int = 0
+    errors: int = 0
+    replayed: int = 0
+    recorded: int = 0
+    lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def bump(self, name: str):
+        with self.lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+def request_key(body: Dict) -> str:
+    relevant = {key: body.get(key) for key in ("model", "messages", "response_format", "tools", "temperature")}
+    return hashlib.sha256(json.dumps(relevant, sort_keys=True).encode("utf-8")).hexdigest()
+
+def _message_text(message: Dict) -> str:
+    content = message.get("content") or ""
+    if isinstance(content, list):
+        return " ".join(part.get("text", "") for part in content if isinstance(part, dict))
+    return content
+
+def canned_questions(content: str, count: int, serial: int) -> Dict:
+    # Vary wording per request so duplicate detection downstream sees distinct questions
+    words = list(dict.fromkeys(WORD_PATTERN.findall(content))) or ["content"]
+    questions = []
+    for i in range(count):
+        topic = " ".join(words[(serial * 7 + i * 3 + k) % len(words)] for k in range(2))
+        questions.append({
+            "question": f"[{serial}.{i}] Which statement about '{topic}' is supported by the text?",
+            "options": [
+                f"A. It is described as central to {topic}",
+                f"B. It is never mentioned alongside {words[i % len(words)]}",
+                f"C. It contradicts the section on {words[(i + 1) % len(words)]}",
+                f"D. It is unrelated to {words[(i + 2) % len(words)]}"
+            ],
+            "correct_answer": "A",
+            "explanation": f"The passage discusses {topic} directly.",
+            "hint": f"Look for where '{topic}' first appears.",
+            "difficulty": ["easy", "medium", "hard"][i % 3]
+        })
+    return {"questions": questions}
+
+def schema_name(body: Dict) -> Optional[str]:
+    response_format = body.get("response_format") or {}
+    if isinstance(response_format.get("json_schema"), dict):
+        return response_format["json_schema"].get("name")
+    tools = body.get("tools") or []
+    return tools[0]["function"]["name"] if tools else None
+
+def canned_payload(body: Dict, serial: int) -> Dict:
+    messages = body.get("messages", [])
+    user_text = " ".join(_message_text(m) for m in messages if m.get("role") == "user")
+    if schema_name(body) == "PackedMCQList":
+        return {"segments": [
+            {"segment": int(number), **canned_questions(text, int(count), serial * 100 + int(number))}
+            for number, count, text in SEGMENT_PATTERN.findall(user_text)
+        ]}
+    match = COUNT_PATTERN.search(user_text)
+    count = int(match.group(1)) if match else 1
+    return canned_questions(user_text, count, serial)
+
+def cacheable_prefix(body: Dict) -> str:
+    """Request text up to the first per-call value (question count or first segment)."""
+    text = "".join(f"{m.get('role')}:{_message_text(m)}" for m in body.get("messages", []))
+    match = COUNT_PATTERN.search(text)
+    end = min(position for position in (text.find(SEGMENT_START), match.start() if match else -1, len(text)) if position >= 0)
+    return text[:end]
+
+def completion_response(body: Dict, payload: Dict, serial: int, cached_tokens: int = 0) -> Dict:
+    arguments = json.dumps(payload, ensure_ascii=False)
+    prompt_chars = sum(len(_message_text(m)) for m in body.get("messages", []))
+    tools = body.get("tools") or []
+
+    message = {"role": "assistant", "content": arguments, "refusal": None}
+    finish_reason = "stop"
+    if tools:
+        message = {
+            "role": "assistant",
+            "content": None,
+            "refusal": None,
+            "tool_calls": [{
+                "id": f"call_stub_{serial}",
+                "type": "function",
+                "function": {"name": tools[0]["function"]["name"], "arguments": arguments}
+            }]
+        }
+        finish_reason = "tool_calls"
+
+    prompt_tokens = max(1, prompt_chars // 4)
+    completion_tokens = max(1, len(arguments) // 4)
+    return {
+        "id": f"chatcmpl-stub-{serial}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": body.get("model", "stub"),
+        "system_fingerprint": "stub",
+        "choices": [{"index": 0, "message": message, "finish_reason": finish_reason, "logprobs": None}],
+        "usage": {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+            "prompt_tokens_details": {"cached_tokens": min(cached_tokens, prompt_tokens)}
+        }
+    }
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address: Tuple[str, int], config: StubConfig):
+        super().__init__(address, StubHandler)
+        self.config = config
+        self.stats = StubStats()
+        self.rng = random.Random(config.seed)
+        self.rng_lock = threading.Lock()
+        self.serial = 0
+        self.recordings: Dict[str, Dict] = {}
+        self.recordings_lock = threading.Lock()
+        self.prefixes = set()
+        if config.replay:
+            with open(config.replay, 'r', encoding='utf-8') as f:
+                for line in f:
+                    entry = json.loads(line)
+                    self.recordings[entry["key"]] = entry["response"]
+
+    def next_serial(self) -> int:
+        with self.rng_lock:
+            self.serial += 1
+            return self.serial
+
+    def roll(self) -> Tuple[float, float]:
+        with self.rng_lock:
+            return self.rng.random(), self.rng.uniform(-self.config.jitter, self.config.jitter)
+
+    def cached_tokens(self, body: Dict) -> int:
+        prefix = cacheable_prefix(body)
+        prefix_tokens = len(prefix) // 4
+        if prefix_tokens < CACHE_MIN_TOKENS:
+            return 0
+        key = hashlib.sha256(prefix.encode("utf-8")).hexdigest()
+        with self.rng_lock:
+            seen = key in self.prefixes
+            self.prefixes.add(key)
+        return prefix_tokens // CACHE_INCREMENT_TOKENS * CACHE_INCREMENT_TOKENS if seen else 0
+
+    def save_recording(self, key: str, response: Dict):
+        with self.recordings_lock:
+            self.recordings[key] = response
+            with open(self.config.record, 'a', encoding='utf-8') as f:
+                f.write(json.dumps({"key": key, "response": response}, ensure_ascii=False) + "\n")
+
+class StubHandler(BaseHTTPRequestHandler):
+    server: StubServer
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status: int, payload: Dict, headers: Optional[Dict] = None):
+        data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path.rstrip("/").endswith("/models"):
+            self._send_json(200, {"object": "list", "data": [{"id": "gpt-4o", "object": "model"}]})
+        else:
+            self._send_json(404, {"error": {"message": f"Unknown path {self.path}", "type": "invalid_request_error"}})
+
+    def do_POST(self):
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self._send_json(404, {"error": {"message": f"Unknown path {self.path}", "type": "invalid_request_error"}})
+            return
+
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        config = self.server.config
+        stats = self.server.stats
+        stats.bump("requests")
+        key = request_key(body)
+        serial = self.server.next_serial()
+        roll, jitter = self.server.roll()
+
+        if config.record:
+            self._forward_and_record(body, key)
+            return
+
+        time.sleep(max(0.0, config.latency + jitter))
+
+        if roll < config.error_rate:
+            stats.bump("errors")
+            if roll < config.error_rate / 2:
+                self._send_json(
+                    429,
+                    {"error": {"message": "Rate limit reached (stub)", "type": "rate_limit_error", "code": "rate_limit_exceeded"}},
+                    headers={"Retry-After": "1"}
+                )
+            else:
+                self._send_json(500, {"error": {"message": "Internal error (stub)", "type": "server_error"}})
+            return
+
+        if key in self.server.recordings:
+            stats.bump("replayed")
+            self._send_json(200, self.server.recordings[key])
+            return
+
+        self._send_json(200, completion_response(body, canned_payload(body, serial), serial, self.server.cached_tokens(body)))
+
+    def _forward_and_record(self, body: Dict, key: str):
+        config = self.server.config
+        api_key = config.upstream_api_key or os.environ.get("OPENAI_API_KEY", "")
+        request = urllib.request.Request(
+            f"{config.upstream.rstrip('/')}/chat/completions",
+            data=json.dumps(body).encode("utf-8"),
+            headers={"Content-Type": "application/json", "Authorization": f"Bearer {api_key}"},
+            method="POST"
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=300) as upstream:
+                response = json.loads(upstream.read())
+        except urllib.error.HTTPError as e:
+            self._send_json(e.code, json.loads(e.read() or b"{}"), headers={
+                name: value for name, value in e.headers.items() if name.lower() == "retry-after"
+            })
+            return
+
+        self.server.save_recording(key, response)
+        self.server.stats.bump("recorded")
+        self._send_json(200, response)
+
+def start_stub(config: StubConfig, host: str = "127.0.0.1", port: int = 0) -> Tuple[StubServer, str]:
+    """Start the stub on a background thread and return it with its OpenAI base URL."""
+    server = StubServer((host, port), config)
+    threading.Thread(target=server.serve_forever, name="openai-stub", daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}/v1"
+
+def add_stub_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--latency", type=float, default=0.5, help="Mean seconds per completion")
+    parser.add_argument("--jitter", type=float, default=0.2, help="Uniform +/- seconds around --latency")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of requests answered with 429/500")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--record", help="Forward to --upstream and append responses to this JSONL file")
+    parser.add_argument("--replay", help="Serve recorded responses from this JSONL file, canned ones otherwise")
+    parser.add_argument("--upstream", default="https://api.openai.com/v1")
+
+def stub_config_from_args(args) -> StubConfig:
+    return StubConfig(
+        latency=args.latency,
+        jitter=args.jitter,
+        error_rate=args.error_rate,
+        seed=args.seed,
+        record=args.record,
+        replay=args.replay,
+        upstream=args.upstream
+    )
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8100)
+    add_stub_arguments(parser)
+    args = parser.parse_args()
+
+    server = StubServer((args.host, args.port), stub_config_from_args(args))
+    print(f"Stub OpenAI listening on http://{args.host}:{args.port}/v1")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(f"Served: {server.stats}")
+
+if __name__ == "__main__":
+    main()
@@ -1,22 +1,33 @@
 from langchain_openai import ChatOpenAI
 from langchain_core.prompts import ChatPromptTemplate
-from core.models import MCQList
-from core.config import OPENAI_API_KEY, OPENAI_MODEL, OPENAI_TEMPERATURE
+from core.models import MCQList, PackedMCQList
+from core.cache import chunk_cache, make_cache_key
+from core.config import (
+    OPENAI_API_KEY, OPENAI_BASE_URL, OPENAI_MODEL, OPENAI_PROMPT_CACHE_KEY, OPENAI_TEMPERATURE, CHUNK_CACHE_ENABLED,
+    CHUNKING_MODE,
+    HTTP_KEEPALIVE_EXPIRY, HTTP_MAX_CONNECTIONS, HTTP_MAX_KEEPALIVE_CONNECTIONS, HTTP_TIMEOUT
+)
+from core.ratelimit import call_with_retries, rate_limiter
+from core.telemetry import LLM_FAILURES, LLM_TOKENS, span
+from core.tokenizer import count_tokens
+from core.tracker import tracker
+from functools import lru_cache
 from typing import List, Tuple
-import tiktoken
+import httpx
 import json
+import threading
+import time
 
-def create_mcq_agent():
-    llm = ChatOpenAI(
-        model=OPENAI_MODEL,
-        temperature=OPENAI_TEMPERATURE,
-        api_key=OPENAI_API_KEY
-    )
-    
-    structured_llm = llm.with_structured_output(MCQList, include_raw=True)
-    
-    prompt = ChatPromptTemplate.from_messages([
-        ("system", """You are an expert educator creating multiple-choice questions.
+# Bump whenever the prompt changes so cached results are not reused across versions
+PROMPT_VERSION = "2"
+
+# Provider-side prompt caching matches on an exact prefix of the request, so everything
+# static (system prompt, output schema) comes first and must stay byte-for-byte identical
+# between calls: no timestamps, ids or per-call values in SYSTEM_PROMPT. Per-call values go
+# last, the chunk content before the question count, so repeated calls on the same chunk
+# (retries, top-ups, other quiz lengths) share everything up to the count.
+
+SYSTEM_PROMPT = """You are an expert educator creating multiple-choice questions.
         
         STRICT FORMATTING RULES:
         - Options MUST be formatted as: "A. text", "B. text", "C. text", "D. text"
@@ -36,52 +47,259 @@ def create_mcq_agent():
         - Distractors should be plausible but wrong
         - Explanation references the content
         - Mix difficulties
-        """),
-        ("user", """Create {count} multiple-choice questions from this content:
+        """
+
+USER_PROMPT = """Content:
+        {content}
+
+        Create {count} multiple-choice questions from the content above.
+        """
+
+# Several short chunks in one call, {content} holds the numbered segments from format_segments
+PACKED_USER_PROMPT = """Create multiple-choice questions for each numbered segment below.
+        Write exactly the number of questions requested for a segment, using only that segment's content,
+        and return them grouped under the segment's number.
         {content}
-        """)
+        """
+
+SEGMENT_HEADER = "[Segment {number}] Create {count} multiple-choice questions from this segment:"
+
+def format_segments(contents: List[str], counts: List[int]) -> str:
+    return "\n\n".join(
+        f"{SEGMENT_HEADER.format(number=number, count=count)}\n{content}"
+        for number, (content, count) in enumerate(zip(contents, counts), start=1)
+    )
+
+@lru_cache(maxsize=None)
+def get_http_clients() -> Tuple[httpx.Client, httpx.AsyncClient]:
+    # One keep-alive pool per process, shared by every agent so TLS connections get reused across documents
+    limits = httpx.Limits(
+        max_connections=HTTP_MAX_CONNECTIONS,
+        max_keepalive_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=HTTP_KEEPALIVE_EXPIRY
+    )
+    return (
+        httpx.Client(limits=limits, timeout=HTTP_TIMEOUT),
+        httpx.AsyncClient(limits=limits, timeout=HTTP_TIMEOUT)
+    )
+
+def create_mcq_agent(model: str = OPENAI_MODEL, temperature: float = OPENAI_TEMPERATURE, packed: bool = False):
+    http_client, http_async_client = get_http_clients()
+    llm = ChatOpenAI(
+        model=model,
+        temperature=temperature,
+        api_key=OPENAI_API_KEY,
+        base_url=OPENAI_BASE_URL,
+        http_client=http_client,
+        http_async_client=http_async_client,
+        # The SDK sends its own timeout with every request, the client's default never applies
+        timeout=HTTP_TIMEOUT,
+        # Retries go through core.ratelimit so they respect the shared RPM/TPM budget
+        max_retries=0,
+        model_kwargs={"prompt_cache_key": f"{OPENAI_PROMPT_CACHE_KEY}-v{PROMPT_VERSION}"} if OPENAI_PROMPT_CACHE_KEY else {}
+    )
+    
+    structured_llm = llm.with_structured_output(PackedMCQList if packed else MCQList, include_raw=True)
+    
+    prompt = ChatPromptTemplate.from_messages([
+        ("system", SYSTEM_PROMPT),
+        ("user", PACKED_USER_PROMPT if packed else USER_PROMPT)
     ])
     
     return prompt | structured_llm
 
+_agents = {}
+_agents_lock = threading.Lock()
+
+def get_mcq_agent(model: str = OPENAI_MODEL, temperature: float = OPENAI_TEMPERATURE, packed: bool = False):
+    """Process-wide agent cache keyed on (model, temperature, PROMPT_VERSION, packed).
+
+    The packed agent takes several numbered segments per call, see generate_mcqs_from_segments.
+    """
+    key = (model, temperature, PROMPT_VERSION, packed)
+    agent = _agents.get(key)
+    if agent is None:
+        with _agents_lock:
+            agent = _agents.get(key)
+            if agent is None:
+                agent = _agents[key] = create_mcq_agent(model, temperature, packed)
+    return agent
+
 def count_tokens_manually(text: str, model: str = "gpt-4o") -> int:
+    return count_tokens(text, model)
+
+# Character-mode guard, token-mode chunks are already sized to the token budget
+MAX_CONTENT_CHARS = 4000
+
+def _fit_content(chunk_text: str) -> str:
+    if CHUNKING_MODE == "token" or len(chunk_text) <= MAX_CONTENT_CHARS:
+        return chunk_text
+    print(f"⚠️ Chunk has {len(chunk_text)} chars, truncating to {MAX_CONTENT_CHARS}")
+    return chunk_text[:MAX_CONTENT_CHARS]
+
+# Rough completion size of one question with options, explanation and hint
+OUTPUT_TOKENS_PER_QUESTION = 150
+
+def _static_prompt_tokens(user_prompt: str) -> int:
     try:
-        encoding = tiktoken.encoding_for_model(model)
-    except KeyError:
-        encoding = tiktoken.get_encoding("cl100k_base")
-    return len(encoding.encode(text))
+        return count_tokens(SYSTEM_PROMPT, OPENAI_MODEL) + count_tokens(user_prompt, OPENAI_MODEL)
+    except Exception:
+        return (len(SYSTEM_PROMPT) + len(user_prompt)) // 4
+
+# The prompts never change, so they are counted once instead of on every call
+PROMPT_TOKENS = _static_prompt_tokens(USER_PROMPT)
+PACKED_PROMPT_TOKENS = _static_prompt_tokens(PACKED_USER_PROMPT)
 
-def generate_mcqs_from_chunk(chunk_text: str, count: int, agent) -> Tuple[List[dict], dict]:
+def estimate_request_tokens(content: str, count: int, packed: bool = False) -> int:
+    """Tokens a call is expected to use, reserved against the TPM limit before dispatch."""
     try:
-        result = agent.invoke({
-            "count": count,
-            "content": chunk_text[:4000]
-        })
+        content_tokens = count_tokens(content, OPENAI_MODEL)
+    except Exception:
+        content_tokens = len(content) // 4
+    prompt_tokens = PACKED_PROMPT_TOKENS if packed else PROMPT_TOKENS
+    return prompt_tokens + content_tokens + count * OUTPUT_TOKENS_PER_QUESTION
+
+def _chunk_cache_key(content: str, count: int, packed: bool = False) -> str:
+    # Questions written through the packed prompt are kept apart from single-chunk ones
+    return make_cache_key(
+        prompt_version=PROMPT_VERSION,
+        system_prompt=SYSTEM_PROMPT,
+        user_prompt=PACKED_USER_PROMPT if packed else USER_PROMPT,
+        content=content,
+        count=count,
+        model=OPENAI_MODEL,
+        temperature=OPENAI_TEMPERATURE
+    )
+
+def _cached_questions(cache_key: str, count: int):
+    cached = chunk_cache.get(cache_key)
+    tracker.log_cache("chunk", hit=cached is not None)
+    if cached is None:
+        return None
+    parsed_output, cached_usage = cached
+    print(f"♻️ Chunk cache hit (saved {cached_usage})")
+    return [q.model_dump() for q in parsed_output.questions[:count]]
+
+def _invoke(agent, inputs: dict, count: int, estimated_tokens: int):
+    def invoke():
+        with span("llm", count=count) as attributes:
+            try:
+                return agent.invoke(inputs)
+            except Exception as e:
+                attributes["error"] = type(e).__name__
+                raise
+    return call_with_retries(invoke, estimated_tokens)
+
+def _token_usage(raw_message, content: str, questions: List, estimated_tokens: int, started: float) -> dict:
+    usage_metadata = raw_message.response_metadata.get("token_usage", {})
+    
+    input_tokens = usage_metadata.get("prompt_tokens", 0)
+    output_tokens = usage_metadata.get("completion_tokens", 0)
+    # Part of input_tokens served from the provider's prompt cache, billed at a discount
+    cached_input_tokens = (usage_metadata.get("prompt_tokens_details") or {}).get("cached_tokens") or 0
+    
+    if input_tokens == 0 and output_tokens == 0:
+        print("⚠️ Metadata missing, calculating tokens manually...")
+        json_output = json.dumps([q.model_dump() for q in questions])
+        input_tokens = count_tokens(content, OPENAI_MODEL)
+        output_tokens = count_tokens(json_output, OPENAI_MODEL)
+        input_tokens += 300
+
+    rate_limiter.reconcile(estimated_tokens, input_tokens + output_tokens)
+
+    usage = {
+        "input_tokens": input_tokens,
+        "cached_input_tokens": cached_input_tokens,
+        "output_tokens": output_tokens,
+        "latency_ms": (time.perf_counter() - started) * 1000
+    }
+
+    print(f"💰 Token Usage: {usage}")
+    LLM_TOKENS.observe(input_tokens, direction="input")
+    LLM_TOKENS.observe(output_tokens, direction="output")
+    return usage
+
+# Cached calls are free, so report zero tokens to keep them out of the bill
+CACHE_HIT_USAGE = {"input_tokens": 0, "output_tokens": 0, "cache_hit": True}
+
+def generate_mcqs_from_chunk(chunk_text: str, count: int, agent, use_cache: bool = CHUNK_CACHE_ENABLED) -> Tuple[List[dict], dict]:
+    content = _fit_content(chunk_text)
+    cache_key = _chunk_cache_key(content, count)
+
+    # use_cache=False forces fresh questions but still refreshes the stored entry
+    if use_cache:
+        cached = _cached_questions(cache_key, count)
+        if cached is not None:
+            return cached, dict(CACHE_HIT_USAGE)
+
+    started = time.perf_counter()
+    estimated_tokens = estimate_request_tokens(content, count)
+    try:
+        result = _invoke(agent, {"count": count, "content": content}, count, estimated_tokens)
         
         parsed_output: MCQList = result['parsed']
-        raw_message = result['raw']
-        
-        usage_metadata = raw_message.response_metadata.get("token_usage", {})
-        
-        input_tokens = usage_metadata.get("prompt_tokens", 0)
-        output_tokens = usage_metadata.get("completion_tokens", 0)
-        
-        if input_tokens == 0 and output_tokens == 0:
-            print("⚠️ Metadata missing, calculating tokens manually...")
-            input_tokens = count_tokens_manually(chunk_text[:4000], OPENAI_MODEL) + 300
-            
-            json_output = json.dumps([q.model_dump() for q in parsed_output.questions])
-            output_tokens = count_tokens_manually(json_output, OPENAI_MODEL)
-
-        usage = {
-            "input_tokens": input_tokens,
-            "output_tokens": output_tokens
-        }
-
-        print(f"💰 Token Usage: {usage}")
+        usage = _token_usage(result['raw'], content, parsed_output.questions, estimated_tokens, started)
+
+        if parsed_output.questions:
+            chunk_cache.set(cache_key, parsed_output, usage)
         
         return [q.model_dump() for q in parsed_output.questions[:count]], usage
         
     except Exception as e:
         print(f"⚠️ MCQ generation failed: {e}")
-        return [], {"input_tokens": 0, "output_tokens": 0}
+        LLM_FAILURES.inc()
+        return [], {"input_tokens": 0, "output_tokens": 0, "latency_ms": (time.perf_counter() - started) * 1000}
+
+def generate_mcqs_from_segments(
+    chunk_texts: List[str],
+    counts: List[int],
+    packed_agent,
+    use_cache: bool = CHUNK_CACHE_ENABLED
+) -> Tuple[List[List[dict]], dict]:
+    """Generate questions for several short chunks in one call of the packed agent.
+
+    Returns each chunk's questions, in input order, and the usage of the single call.
+    Chunks already in the chunk cache are left out of the request, and each chunk's
+    questions are cached on their own, under a key for the packed prompt.
+    """
+    contents = [_fit_content(text) for text in chunk_texts]
+    cache_keys = [_chunk_cache_key(content, count, packed=True) for content, count in zip(contents, counts)]
+    questions: List[List[dict]] = [[] for _ in contents]
+
+    missing = []
+    for i, (cache_key, count) in enumerate(zip(cache_keys, counts)):
+        cached = _cached_questions(cache_key, count) if use_cache else None
+        if cached is None:
+            missing.append(i)
+        else:
+            questions[i] = cached
+
+    if not missing:
+        return questions, dict(CACHE_HIT_USAGE)
+
+    content = format_segments([contents[i] for i in missing], [counts[i] for i in missing])
+    total = sum(counts[i] for i in missing)
+    started = time.perf_counter()
+    estimated_tokens = estimate_request_tokens(content, total, packed=True)
+    try:
+        result = _invoke(packed_agent, {"content": content}, total, estimated_tokens)
+
+        parsed_output: PackedMCQList = result['parsed']
+        returned = [q for segment in parsed_output.segments for q in segment.questions]
+        usage = _token_usage(result['raw'], content, returned, estimated_tokens, started)
+        usage["packed_segments"] = len(missing)
+
+        # Segment numbers are 1-based positions among the chunks that were sent
+        for segment in parsed_output.segments:
+            if not 1 <= segment.segment <= len(missing) or not segment.questions:
+                continue
+            i = missing[segment.segment - 1]
+            questions[i] = [q.model_dump() for q in segment.questions[:counts[i]]]
+            chunk_cache.set(cache_keys[i], MCQList(questions=segment.questions), usage)
+
+        return questions, usage
+
+    except Exception as e:
+        print(f"⚠️ Packed MCQ generation failed: {e}")
+        LLM_FAILURES.inc()
+        return questions, {"input_tokens": 0, "output_tokens": 0, "latency_ms": (time.perf_counter() - started) * 1000}
@@ -0,0 +1,246 @@
+from array import array
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from core.config import (
+    CHUNK_CACHE_MAX_ENTRIES, RESULT_CACHE_MAX_MB, RESULT_CACHE_TTL_HOURS, TEXT_CACHE_MAX_MB
+)
+from core.models import MCQList
+
+CACHE_DIR = "data/cache"
+
+def hash_bytes(data) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+def hash_file(file_path: str) -> str:
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def make_cache_key(**parts) -> str:
+    payload = json.dumps(parts, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def _atomic_write(path: str, data: bytes) -> None:
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+
+def _evict_directory(directory: str, max_size_bytes: int, ttl_seconds: int) -> None:
+    now = time.time()
+    entries = []
+    for name in os.listdir(directory):
+        if name.endswith(".tmp"):
+            continue
+        path = os.path.join(directory, name)
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            continue
+        if now - stat.st_mtime > ttl_seconds:
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            continue
+        entries.append((stat.st_mtime, stat.st_size, path))
+
+    total_size = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total_size <= max_size_bytes:
+            break
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+        total_size -= size
+
+def _read_fresh(path: str, ttl_seconds: int) -> bytes:
+    # Bytes as written: text mode would translate \r\n and shift cached chunk offsets
+    if time.time() - os.path.getmtime(path) > ttl_seconds:
+        os.unlink(path)
+        raise FileNotFoundError(path)
+    with open(path, 'rb') as f:
+        value = f.read()
+    os.utime(path)
+    return value
+
+class _DirectoryCache:
+    """Files in one directory. Entries older than `ttl_seconds` are dropped, and
+    once the directory grows past `max_size_mb` the least recently used files
+    (by mtime, refreshed on every hit) are evicted first."""
+
+    def __init__(self, directory: str, max_size_mb: int, ttl_seconds: int):
+        self.directory = directory
+        self.max_size_bytes = max_size_mb * 1024 * 1024
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        os.makedirs(self.directory, exist_ok=True)
+
+    def evict(self) -> None:
+        # Another process may be evicting the same directory, a failed pass is retried on the next write
+        with self._lock:
+            try:
+                _evict_directory(self.directory, self.max_size_bytes, self.ttl_seconds)
+            except OSError as e:
+                print(f"⚠️ Cache eviction failed in {self.directory}: {e}")
+
+class ResultCache(_DirectoryCache):
+    """Disk cache of whole-document results, one JSON file per key."""
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.json")
+
+    def get(self, key: str) -> Optional[Dict]:
+        try:
+            return json.loads(_read_fresh(self._path(key), self.ttl_seconds))
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            print(f"⚠️ Failed to read cache entry {key[:12]}: {e}")
+            return None
+
+    def set(self, key: str, value: Dict) -> None:
+        try:
+            _atomic_write(self._path(key), json.dumps(value, ensure_ascii=False).encode("utf-8"))
+        except Exception as e:
+            print(f"⚠️ Failed to write cache entry {key[:12]}: {e}")
+            return
+        self.evict()
+
+class TextCache(_DirectoryCache):
+    """Disk cache of extracted PDF text and chunk boundaries.
+
+    The text is stored once per PDF as `<pdf_hash>.txt`. Each chunker
+    configuration adds a small `<pdf_hash>.<config_key>.idx` file of packed
+    (start, end, token_count) triples pointing into that text, so changing the
+    chunker settings only invalidates the offsets, never the extraction.
+    """
+
+    def _text_path(self, pdf_hash: str) -> str:
+        return os.path.join(self.directory, f"{pdf_hash}.txt")
+
+    def _offsets_path(self, pdf_hash: str, config_key: str) -> str:
+        return os.path.join(self.directory, f"{pdf_hash}.{config_key[:16]}.idx")
+
+    def get_text(self, pdf_hash: str) -> Optional[str]:
+        try:
+            return _read_fresh(self._text_path(pdf_hash), self.ttl_seconds).decode("utf-8")
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            print(f"⚠️ Failed to read cached text {pdf_hash[:12]}: {e}")
+            return None
+
+    def get_offsets(self, pdf_hash: str, config_key: str) -> Optional[List[Tuple[int, int, int]]]:
+        try:
+            packed = array('I')
+            packed.frombytes(_read_fresh(self._offsets_path(pdf_hash, config_key), self.ttl_seconds))
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            print(f"⚠️ Failed to read cached chunks {pdf_hash[:12]}: {e}")
+            return None
+        return [tuple(packed[i:i + 3]) for i in range(0, len(packed), 3)]
+
+    def set_text(self, pdf_hash: str, text: str) -> None:
+        try:
+            _atomic_write(self._text_path(pdf_hash), text.encode("utf-8"))
+        except Exception as e:
+            print(f"⚠️ Failed to cache text {pdf_hash[:12]}: {e}")
+            return
+        self.evict()
+
+    def set_offsets(self, pdf_hash: str, config_key: str, offsets: List[Tuple[int, int, int]]) -> None:
+        packed = array('I', [value for triple in offsets for value in triple])
+        try:
+            _atomic_write(self._offsets_path(pdf_hash, config_key), packed.tobytes())
+        except Exception as e:
+            print(f"⚠️ Failed to cache chunks {pdf_hash[:12]}: {e}")
+
+class ChunkCache:
+    """SQLite memo of per-chunk agent results, bounded to `max_entries` with LRU eviction."""
+
+    def __init__(self, db_path: str, max_entries: int):
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, timeout=30)
+        with self._lock, self._conn:
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS chunk_results (
+                    key TEXT PRIMARY KEY,
+                    questions TEXT NOT NULL,
+                    usage TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    last_access REAL NOT NULL
+                )
+            """)
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_chunk_results_last_access ON chunk_results (last_access)"
+            )
+
+    def get(self, key: str) -> Optional[Tuple[MCQList, Dict]]:
+        try:
+            with self._lock, self._conn:
+                row = self._conn.execute(
+                    "SELECT questions, usage FROM chunk_results WHERE key = ?", (key,)
+                ).fetchone()
+                if row is None:
+                    return None
+                self._conn.execute(
+                    "UPDATE chunk_results SET last_access = ? WHERE key = ?", (time.time(), key)
+                )
+            return MCQList.model_validate_json(row[0]), json.loads(row[1])
+        except Exception as e:
+            print(f"⚠️ Failed to read chunk cache: {e}")
+            return None
+
+    def set(self, key: str, questions: MCQList, usage: Dict) -> None:
+        now = time.time()
+        try:
+            with self._lock, self._conn:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO chunk_results VALUES (?, ?, ?, ?, ?)",
+                    (key, questions.model_dump_json(), json.dumps(usage), now, now)
+                )
+                self._conn.execute(
+                    """
+                    DELETE FROM chunk_results WHERE key IN (
+                        SELECT key FROM chunk_results ORDER BY last_access DESC LIMIT -1 OFFSET ?
+                    )
+                    """,
+                    (self.max_entries,)
+                )
+        except Exception as e:
+            print(f"⚠️ Failed to write chunk cache: {e}")
+
+result_cache = ResultCache(
+    directory=os.path.join(CACHE_DIR, "results"),
+    max_size_mb=RESULT_CACHE_MAX_MB,
+    ttl_seconds=RESULT_CACHE_TTL_HOURS * 3600
+)
+
+chunk_cache = ChunkCache(
+    db_path=os.path.join(CACHE_DIR, "chunks.sqlite3"),
+    max_entries=CHUNK_CACHE_MAX_ENTRIES
+)
+
+text_cache = TextCache(
+    directory=os.path.join(CACHE_DIR, "text"),
+    max_size_mb=TEXT_CACHE_MAX_MB,
+    ttl_seconds=RESULT_CACHE_TTL_HOURS * 3600
+)
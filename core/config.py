@@ -1,9 +1,60 @@
+from typing import Optional
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 class Settings(BaseSettings):
     openai_api_key: str
     openai_model: str = "gpt-4o"
     openai_temperature: float = 0.7
+    openai_base_url: Optional[str] = None
+    openai_prompt_cache_key: str = "mcq-agent"  # routes calls sharing the prompt prefix together, empty = don't send
+    mcq_max_concurrency: int = 4
+    openai_rpm_limit: int = 500  # 0 = unlimited
+    openai_tpm_limit: int = 30000  # 0 = unlimited
+    llm_max_retries: int = 4
+    llm_backoff_base_seconds: float = 1.0
+    llm_backoff_max_seconds: float = 30.0
+    result_cache_enabled: bool = True
+    result_cache_max_mb: int = 200
+    result_cache_ttl_hours: int = 168
+    chunk_cache_enabled: bool = True
+    chunk_cache_max_entries: int = 5000
+    text_cache_enabled: bool = True
+    text_cache_max_mb: int = 500
+    max_pdf_size_mb: float = 200
+    stream_pdf_above_mb: float = 10  # larger PDFs are extracted, chunked and sent page by page, 0 = always
+    pdf_extract_workers: int = 0  # 0 = one per CPU
+    pdf_parallel_min_pages: int = 32
+    chunking_mode: str = "character"  # "character" or "token"
+    chunk_token_budget: int = 1000
+    chunk_sampling: str = "stratified"  # "sequential", "stratified" or "diverse", used when questions < chunks
+    chunk_sampling_seed: int = 0
+    pack_max_tokens: int = 1000  # adjacent chunks up to this size share one call, 0 = one chunk per call
+    pack_max_segments: int = 8
+    http_max_connections: int = 50
+    http_max_keepalive_connections: int = 20
+    http_keepalive_expiry: float = 60.0
+    http_timeout: float = 120.0
+    job_workers: int = 2
+    job_queue_size: int = 8
+    job_ttl_minutes: int = 60
+    persist_uploads: bool = False  # also keep a copy of each upload in uploads/, processing never needs it
+    dedup_enabled: bool = True
+    dedup_threshold: float = 0.6  # word-shingle Jaccard similarity that counts as a duplicate
+    topup_max_rounds: int = 2
+    topup_questions_per_call: int = 3
+    # Counters are per process, so {host} and {pid} keep processes sharing ./data apart. Empty = don't write, scrape /metrics instead
+    metrics_file: str = "data/metrics.{host}.{pid}.prom"
+    langflow_base_url: str = "http://172.17.0.1:7860"
+    langflow_flow_id: str = "17f0755a-bee6-4380-8f1d-84aef615ac0d"
+    langflow_api_key: str = ""
+    langflow_file_component: str = "File-hacxY"
+    langflow_prompt_component: str = "PromptNodeIdIfAny"
+    langflow_connect_timeout_seconds: float = 10.0
+    langflow_read_timeout_seconds: float = 300.0  # flow runs wait for the LLM
+    langflow_max_retries: int = 3
+    langflow_max_connections: int = 10
+    langflow_questions_per_run: int = 10  # larger requests are split into parallel flow runs, 0 = one run
+    langflow_max_concurrent_runs: int = 4
     
     model_config = SettingsConfigDict(
         env_file=".env",
@@ -16,3 +67,52 @@ settings = Settings()
 OPENAI_API_KEY = settings.openai_api_key
 OPENAI_MODEL = settings.openai_model
 OPENAI_TEMPERATURE = settings.openai_temperature
+OPENAI_BASE_URL = settings.openai_base_url
+OPENAI_PROMPT_CACHE_KEY = settings.openai_prompt_cache_key
+MCQ_MAX_CONCURRENCY = settings.mcq_max_concurrency
+OPENAI_RPM_LIMIT = settings.openai_rpm_limit
+OPENAI_TPM_LIMIT = settings.openai_tpm_limit
+LLM_MAX_RETRIES = settings.llm_max_retries
+LLM_BACKOFF_BASE_SECONDS = settings.llm_backoff_base_seconds
+LLM_BACKOFF_MAX_SECONDS = settings.llm_backoff_max_seconds
+RESULT_CACHE_ENABLED = settings.result_cache_enabled
+RESULT_CACHE_MAX_MB = settings.result_cache_max_mb
+RESULT_CACHE_TTL_HOURS = settings.result_cache_ttl_hours
+CHUNK_CACHE_ENABLED = settings.chunk_cache_enabled
+CHUNK_CACHE_MAX_ENTRIES = settings.chunk_cache_max_entries
+TEXT_CACHE_ENABLED = settings.text_cache_enabled
+TEXT_CACHE_MAX_MB = settings.text_cache_max_mb
+MAX_PDF_SIZE_MB = settings.max_pdf_size_mb
+STREAM_PDF_ABOVE_MB = settings.stream_pdf_above_mb
+PDF_EXTRACT_WORKERS = settings.pdf_extract_workers
+PDF_PARALLEL_MIN_PAGES = settings.pdf_parallel_min_pages
+CHUNKING_MODE = settings.chunking_mode
+CHUNK_TOKEN_BUDGET = settings.chunk_token_budget
+CHUNK_SAMPLING = settings.chunk_sampling
+CHUNK_SAMPLING_SEED = settings.chunk_sampling_seed
+PACK_MAX_TOKENS = settings.pack_max_tokens
+PACK_MAX_SEGMENTS = settings.pack_max_segments
+HTTP_MAX_CONNECTIONS = settings.http_max_connections
+HTTP_MAX_KEEPALIVE_CONNECTIONS = settings.http_max_keepalive_connections
+HTTP_KEEPALIVE_EXPIRY = settings.http_keepalive_expiry
+HTTP_TIMEOUT = settings.http_timeout
+JOB_WORKERS = settings.job_workers
+JOB_QUEUE_SIZE = settings.job_queue_size
+JOB_TTL_MINUTES = settings.job_ttl_minutes
+PERSIST_UPLOADS = settings.persist_uploads
+DEDUP_ENABLED = settings.dedup_enabled
+DEDUP_THRESHOLD = settings.dedup_threshold
+TOPUP_MAX_ROUNDS = settings.topup_max_rounds
+TOPUP_QUESTIONS_PER_CALL = settings.topup_questions_per_call
+METRICS_FILE = settings.metrics_file
+LANGFLOW_BASE_URL = settings.langflow_base_url
+LANGFLOW_FLOW_ID = settings.langflow_flow_id
+LANGFLOW_API_KEY = settings.langflow_api_key
+LANGFLOW_FILE_COMPONENT = settings.langflow_file_component
+LANGFLOW_PROMPT_COMPONENT = settings.langflow_prompt_component
+LANGFLOW_CONNECT_TIMEOUT_SECONDS = settings.langflow_connect_timeout_seconds
+LANGFLOW_READ_TIMEOUT_SECONDS = settings.langflow_read_timeout_seconds
+LANGFLOW_MAX_RETRIES = settings.langflow_max_retries
+LANGFLOW_MAX_CONNECTIONS = settings.langflow_max_connections
+LANGFLOW_QUESTIONS_PER_RUN = settings.langflow_questions_per_run
+LANGFLOW_MAX_CONCURRENT_RUNS = settings.langflow_max_concurrent_runs
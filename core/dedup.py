@@ -0,0 +1,59 @@
+import re
+from typing import FrozenSet, List, Set
+from core.config import DEDUP_THRESHOLD
+
+WORD_PATTERN = re.compile(r"\w+", re.UNICODE)
+OPTION_PREFIX = re.compile(r"^\s*[A-D]\s*[.)]\s*")
+SHINGLE_SIZE = 2
+
+def _correct_option(question: dict) -> str:
+    letter = question.get("correct_answer", "")
+    for option in question.get("options", []):
+        if option.strip().startswith(f"{letter}."):
+            return OPTION_PREFIX.sub("", option)
+    return ""
+
+def question_words(question: dict) -> List[str]:
+    """Lowercased words of the question text plus its correct answer."""
+    text = f"{question.get('question', '')} {_correct_option(question)}"
+    return WORD_PATTERN.findall(text.lower())
+
+def shingles(words: List[str], size: int = SHINGLE_SIZE) -> FrozenSet[tuple]:
+    if len(words) <= size:
+        return frozenset([tuple(words)])
+    return frozenset(tuple(words[i:i + size]) for i in range(len(words) - size + 1))
+
+def jaccard(a: FrozenSet, b: FrozenSet) -> float:
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+class QuestionDeduper:
+    """Drops questions whose word shingles overlap an accepted one by `threshold` or more.
+
+    Question sets are at most a few hundred items, so accepted shingle sets are
+    compared pairwise, with an exact-match set in front for verbatim repeats.
+    """
+
+    def __init__(self, threshold: float = DEDUP_THRESHOLD):
+        self.threshold = threshold
+        self._exact: Set[str] = set()
+        self._accepted: List[FrozenSet[tuple]] = []
+        self.duplicates = 0
+
+    def _is_duplicate(self, key: str, candidate: FrozenSet[tuple]) -> bool:
+        if key in self._exact:
+            return True
+        return any(jaccard(candidate, accepted) >= self.threshold for accepted in self._accepted)
+
+    def add(self, question: dict) -> bool:
+        """Accept `question` unless it duplicates an earlier one, returns whether it was kept."""
+        words = question_words(question)
+        key = " ".join(words)
+        candidate = shingles(words)
+        if self._is_duplicate(key, candidate):
+            self.duplicates += 1
+            return False
+        self._exact.add(key)
+        self._accepted.append(candidate)
+        return True
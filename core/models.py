@@ -50,3 +50,10 @@ class MCQQuestion(BaseModel):
 class MCQList(BaseModel):
     questions: List[MCQQuestion] = Field(description="Generated questions")
 
+
+class SegmentMCQs(BaseModel):
+    segment: int = Field(description="Number of the segment the questions were written from")
+    questions: List[MCQQuestion] = Field(description="Questions generated from this segment only")
+
+class PackedMCQList(BaseModel):
+    segments: List[SegmentMCQs] = Field(description="Generated questions grouped by source segment")
@@ -1,13 +1,125 @@
-from typing import List, Tuple
+from bisect import bisect_left, bisect_right
+from collections import deque
+import io
+from typing import BinaryIO, Iterator, List, Optional, Tuple, Union
 from pypdf import PdfReader
-from chonkie import RecursiveChunker, RecursiveRules
+from chonkie import Chunk, RecursiveChunker, RecursiveRules
+from core.cache import hash_bytes, hash_file, make_cache_key, text_cache
+from core.config import (
+    CHUNK_TOKEN_BUDGET, CHUNKING_MODE, MAX_PDF_SIZE_MB, OPENAI_MODEL, PDF_EXTRACT_WORKERS, PDF_PARALLEL_MIN_PAGES,
+    TEXT_CACHE_ENABLED
+)
+from core.telemetry import span
+from core.tokenizer import encoding_name_for_model, get_encoding
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import contextlib
+from itertools import repeat
+import multiprocessing
 import os
+import tempfile
+import threading
 
-def validate_pdf_size(file_path: str, max_size_mb: int = 10) -> None:
-    if not os.path.exists(file_path):
-        raise FileNotFoundError(f"PDF file not found: {file_path}")
-    
-    file_size_bytes = os.path.getsize(file_path)
+# A path, the PDF's bytes (bytes, bytearray, memoryview) or a binary stream
+PdfSource = Union[str, os.PathLike, bytes, bytearray, memoryview, BinaryIO]
+
+PAGE_SEPARATOR = "\n\n"
+# Streaming mode extracts this many pages per batch and chunks a window of this many chunks' worth of text at a time
+STREAM_PAGES_PER_BATCH = 16
+STREAM_WINDOW_CHUNKS = 8
+
+# Coarse to fine split points for token mode, the last resort is cutting between tokens
+TOKEN_SEPARATORS = ["\n\n", "\n", ". ", "؟ ", " "]
+
+def _chunker_config(mode: str) -> dict:
+    if mode == "token":
+        return {
+            "mode": "token",
+            "tokenizer": encoding_name_for_model(OPENAI_MODEL),
+            "chunk_size": CHUNK_TOKEN_BUDGET,
+            "fallback_chunk_size": CHUNK_TOKEN_BUDGET * 4,
+        }
+    return {
+        "mode": "character",
+        "tokenizer": "character",
+        "chunk_size": 4000,
+        "min_characters_per_chunk": 100,
+        "fallback_chunk_size": 4000,
+    }
+
+# Any change here changes CHUNKER_CONFIG_KEY and invalidates cached chunk offsets
+CHUNKER_CONFIG = _chunker_config(CHUNKING_MODE)
+CHUNKER_CONFIG_KEY = make_cache_key(**CHUNKER_CONFIG)
+
+class _BufferReader(io.RawIOBase):
+    """Seekable read-only stream over a memoryview, so each reader gets its own
+    position on a shared buffer without copying it."""
+
+    def __init__(self, buffer: memoryview):
+        self._buffer = buffer
+        self._position = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def readinto(self, b) -> int:
+        data = self._buffer[self._position:self._position + len(b)]
+        b[:len(data)] = data
+        self._position += len(data)
+        return len(data)
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self._position, io.SEEK_END: len(self._buffer)}[whence]
+        self._position = max(0, base + offset)
+        return self._position
+
+    def tell(self) -> int:
+        return self._position
+
+def pdf_source(source: PdfSource) -> Union[str, memoryview]:
+    """Normalize `source` to a path or a flat memoryview.
+
+    In-memory uploads (BytesIO, Streamlit's UploadedFile) are viewed in place,
+    other streams are read once.
+    """
+    if isinstance(source, (str, os.PathLike)):
+        return os.fspath(source)
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return memoryview(source).cast("B")
+    if hasattr(source, "getbuffer"):
+        return source.getbuffer().cast("B")
+    source.seek(0)
+    return memoryview(source.read())
+
+def open_pdf_stream(source: PdfSource) -> BinaryIO:
+    """A new binary stream over `source` from its first byte, for sending it elsewhere."""
+    source = pdf_source(source)
+    if isinstance(source, str):
+        return open(source, "rb")
+    return io.BufferedReader(_BufferReader(source))
+
+def _open_reader(source: Union[str, memoryview]) -> PdfReader:
+    if isinstance(source, str):
+        return PdfReader(source)
+    return PdfReader(_BufferReader(source))
+
+def pdf_size_bytes(source: PdfSource) -> int:
+    source = pdf_source(source)
+    if isinstance(source, str):
+        if not os.path.exists(source):
+            raise FileNotFoundError(f"PDF file not found: {source}")
+        return os.path.getsize(source)
+    return source.nbytes
+
+def hash_pdf(source: PdfSource) -> str:
+    source = pdf_source(source)
+    return hash_file(source) if isinstance(source, str) else hash_bytes(source)
+
+def validate_pdf_size(source: PdfSource, max_size_mb: float = MAX_PDF_SIZE_MB) -> None:
+    file_size_bytes = pdf_size_bytes(source)
     file_size_mb = file_size_bytes / (1024 * 1024)
     
     if file_size_mb > max_size_mb:
@@ -17,54 +129,336 @@ def validate_pdf_size(file_path: str, max_size_mb: int = 10) -> None:
     
     print(f"✓ PDF size: {file_size_mb:.2f}MB")
 
-def extract_text_from_pdf(file_path: str) -> str:
+# Shared by every extraction in the process. Its workers come from a forkserver (or
+# spawn) context, forking the app's threaded processes could copy a held lock
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+def _shared_pool(workers: int) -> ProcessPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+            size = max(workers, PDF_EXTRACT_WORKERS or os.cpu_count() or 1)
+            _pool = ProcessPoolExecutor(max_workers=size, mp_context=multiprocessing.get_context(method))
+        return _pool
+
+@contextlib.contextmanager
+def _extraction_pool(source: Union[str, memoryview], workers: int) -> Iterator[Tuple[ProcessPoolExecutor, str]]:
+    """The shared extraction pool and the path its tasks open.
+
+    Workers cannot see an in-memory PDF, so it is written once to a temporary
+    file they all read, rather than pickled to each of them.
+    """
+    global _pool
+    path = source
+    if not isinstance(source, str):
+        with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as f:
+            f.write(source)
+        path = f.name
+    try:
+        yield _shared_pool(workers), path
+    except BrokenProcessPool:
+        # A worker died, the next extraction starts a new pool
+        with _pool_lock:
+            _pool = None
+        raise
+    finally:
+        if path is not source:
+            os.unlink(path)
+
+def _extract_numbered_pages(source: Union[str, memoryview], start: int, end: int) -> List[Tuple[int, str]]:
+    # Runs in pool workers too, so it opens its own reader instead of receiving one
+    reader = _open_reader(source)
+    text_content = []
+    
+    for page_num in range(start, end):
+        try:
+            page_text = reader.pages[page_num].extract_text()
+            if page_text and page_text.strip():
+                text_content.append((page_num, page_text.strip()))
+        except Exception as e:
+            print(f"⚠️ Cannot extract page {page_num + 1}: {e}")
+            continue
+    
+    return text_content
+
+def _extract_pages(source: Union[str, memoryview], start: int, end: int) -> List[str]:
+    return [text for _, text in _extract_numbered_pages(source, start, end)]
+
+def _page_ranges(num_pages: int, num_parts: int) -> List[Tuple[int, int]]:
+    step = -(-num_pages // num_parts)
+    return [(start, min(start + step, num_pages)) for start in range(0, num_pages, step)]
+
+def extract_text_from_pdf(source: PdfSource, workers: int = PDF_EXTRACT_WORKERS) -> str:
     try:
-        reader = PdfReader(file_path)
-        text_content = []
+        source = pdf_source(source)
+        num_pages = len(_open_reader(source).pages)
+        workers = min(workers or os.cpu_count() or 1, num_pages)
         
-        for page_num, page in enumerate(reader.pages, 1):
-            try:
-                page_text = page.extract_text()
-                if page_text and page_text.strip():
-                    text_content.append(page_text.strip())
-            except Exception as e:
-                print(f"⚠️ Cannot extract page {page_num}: {e}")
-                continue
+        # Pool startup only pays off once there are enough pages to spread around
+        if workers > 1 and num_pages >= PDF_PARALLEL_MIN_PAGES:
+            ranges = _page_ranges(num_pages, workers * 2)
+            with _extraction_pool(source, workers) as (pool, task_source):
+                parts = pool.map(_extract_pages, repeat(task_source), *zip(*ranges))
+                text_content = [page for part in parts for page in part]
+        else:
+            text_content = _extract_pages(source, 0, num_pages)
         
         if not text_content:
             return "Empty PDF"
         
-        return "\n\n".join(text_content)
+        return PAGE_SEPARATOR.join(text_content)
         
     except Exception as e:
         print(f"❌ PDF Error: {e}")
         raise
 
-def chunk_text(text: str) -> List:
+def _split_keep(text: str, separator: str) -> List[str]:
+    parts = text.split(separator)
+    pieces = [part + separator for part in parts[:-1]] + [parts[-1]]
+    return [piece for piece in pieces if piece]
+
+def _token_pieces(text: str, encoding, budget: int, level: int = 0) -> List[Tuple[str, int]]:
+    tokens = encoding.encode_ordinary(text)
+    if len(tokens) <= budget:
+        return [(text, len(tokens))]
+
+    if level == len(TOKEN_SEPARATORS):
+        # Cut every `budget` tokens, snapped to character offsets so multi-byte
+        # characters (Arabic, accents) are never split
+        _, offsets = encoding.decode_with_offsets(tokens)
+        cuts = sorted({0, len(text), *(offsets[i] for i in range(budget, len(tokens), budget))})
+        pieces = [text[start:end] for start, end in zip(cuts, cuts[1:])]
+        return [(piece, len(encoding.encode_ordinary(piece))) for piece in pieces]
+
+    pieces = []
+    for part in _split_keep(text, TOKEN_SEPARATORS[level]):
+        pieces.extend(_token_pieces(part, encoding, budget, level + 1))
+    return pieces
+
+def chunk_text_by_tokens(text: str, encoding, budget: int) -> List[Chunk]:
+    """Greedily pack paragraphs, lines, sentences and words into chunks of at most `budget` tokens.
+
+    Chunks are contiguous slices of `text` that together cover all of it.
+    """
+    chunks = []
+    start = position = tokens_so_far = 0
+
+    def close_chunk():
+        chunk = text[start:position]
+        chunks.append(Chunk(
+            text=chunk,
+            start_index=start,
+            end_index=position,
+            token_count=len(encoding.encode_ordinary(chunk))
+        ))
+
+    for piece, piece_tokens in _token_pieces(text, encoding, budget):
+        if position > start and tokens_so_far + piece_tokens > budget:
+            close_chunk()
+            start, tokens_so_far = position, 0
+        position += len(piece)
+        tokens_so_far += piece_tokens
+
+    if position > start:
+        close_chunk()
+    return chunks
+
+def chunk_text(text: str, config: dict = CHUNKER_CONFIG) -> List:
     try:
+        if config["mode"] == "token":
+            encoding = get_encoding(OPENAI_MODEL)
+            return chunk_text_by_tokens(text, encoding, config["chunk_size"])
+
         chunker = RecursiveChunker(
-            tokenizer="character",
-            chunk_size=4000,
+            tokenizer=config["tokenizer"],
+            chunk_size=config["chunk_size"],
             rules=RecursiveRules(),
-            min_characters_per_chunk=100,
+            min_characters_per_chunk=config["min_characters_per_chunk"],
         )       
         chunks = chunker.chunk(text)
         return chunks
         
     except Exception as e:
-        print(f"⚠️ Chonkie chunking failed: {e}")
-        chunk_size = 1000
+        print(f"⚠️ Chunking failed: {e}")
+        chunk_size = config["fallback_chunk_size"]
         return [text[i:i + chunk_size] for i in range(0, len(text), chunk_size)]
 
-def load_and_chunk_pdf(file_path: str) -> Tuple[str, List]:
+def chunk_offsets(text: str, chunks: List) -> Optional[List[Tuple[int, int, int]]]:
+    offsets = []
+    position = 0
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            start, end, token_count = position, position + len(chunk), len(chunk)
+        else:
+            start, end, token_count = chunk.start_index, chunk.end_index, chunk.token_count
+        if text[start:end] != (chunk if isinstance(chunk, str) else chunk.text):
+            return None
+        offsets.append((start, end, token_count))
+        position = end
+    return offsets
+
+def chunks_from_offsets(text: str, offsets: List[Tuple[int, int, int]]) -> List[Chunk]:
+    return [
+        Chunk(text=text[start:end], start_index=start, end_index=end, token_count=token_count)
+        for start, end, token_count in offsets
+    ]
+
+def iter_pdf_pages(source: PdfSource, workers: int = PDF_EXTRACT_WORKERS) -> Iterator[Tuple[int, str]]:
+    """Yield `(page_number, text)` for every non-empty page, in order, without holding the whole document.
+
+    Pages are extracted STREAM_PAGES_PER_BATCH at a time by a fresh reader, so parsed
+    page objects do not accumulate. With several workers a few batches are
+    extracted ahead in a process pool.
+    """
+    source = pdf_source(source)
+    num_pages = len(_open_reader(source).pages)
+    ranges = [(start, min(start + STREAM_PAGES_PER_BATCH, num_pages)) for start in range(0, num_pages, STREAM_PAGES_PER_BATCH)]
+    workers = min(workers or os.cpu_count() or 1, len(ranges))
+
+    if workers <= 1:
+        for start, end in ranges:
+            with span("extract", pages=end - start):
+                batch = _extract_numbered_pages(source, start, end)
+            yield from batch
+        return
+
+    with _extraction_pool(source, workers) as (pool, task_source):
+        ahead = deque()
+        try:
+            for start, end in ranges:
+                ahead.append((end - start, pool.submit(_extract_numbered_pages, task_source, start, end)))
+                while len(ahead) > (workers if start + STREAM_PAGES_PER_BATCH < num_pages else 0):
+                    pages, future = ahead.popleft()
+                    # Measures the wait for the batch, extraction itself overlaps with earlier batches
+                    with span("extract", pages=pages):
+                        batch = future.result()
+                    yield from batch
+        finally:
+            # The pool outlives this reader, batches it no longer wants are dropped
+            for _, future in ahead:
+                future.cancel()
+
+def _window_offsets(text: str, config: dict) -> List[Tuple[int, int, int]]:
+    offsets = chunk_offsets(text, chunk_text(text, config))
+    if offsets is None:
+        size = config["fallback_chunk_size"]
+        offsets = [(i, min(i + size, len(text)), min(size, len(text) - i)) for i in range(0, len(text), size)]
+    return offsets
+
+class PdfTextStream:
+    """Pages and chunks of a PDF produced lazily, for documents too large to hold as one string.
+
+    Chunk offsets refer to the text `extract_text_from_pdf` would return. Only
+    page offsets and chunk offsets are kept, `chunk_at` re-extracts the pages a
+    chunk spans when its text is needed again.
+    """
+
+    def __init__(self, source: PdfSource, config: dict = CHUNKER_CONFIG, workers: int = PDF_EXTRACT_WORKERS):
+        self.source = pdf_source(source)
+        self.config = config
+        self.workers = workers
+        self.num_pages = len(_open_reader(self.source).pages)
+        self.page_offsets: List[int] = []
+        self.page_numbers: List[int] = []
+        self.chunk_offsets: List[Tuple[int, int, int]] = []
+        self.text_length = 0
+
+    @property
+    def num_chunks(self) -> int:
+        return len(self.chunk_offsets)
+
+    def pages(self) -> Iterator[str]:
+        for page_num, text in iter_pdf_pages(self.source, self.workers):
+            offset = self.text_length + len(PAGE_SEPARATOR) if self.page_offsets else 0
+            self.page_offsets.append(offset)
+            self.page_numbers.append(page_num)
+            self.text_length = offset + len(text)
+            yield text
+
+    def chunks(self) -> Iterator[Chunk]:
+        """Chunk the page stream a window at a time.
+
+        Each window holds about STREAM_WINDOW_CHUNKS chunks of text. All its chunks but
+        the last are emitted, and the last is carried into the next window so chunk
+        boundaries do not depend on where pages end.
+        """
+        chunk_chars = self.config["chunk_size"] * (4 if self.config["mode"] == "token" else 1)
+        window_chars = STREAM_WINDOW_CHUNKS * chunk_chars
+        buffer = ""
+        base = 0
+
+        def emit(offsets):
+            for start, end, token_count in offsets:
+                self.chunk_offsets.append((base + start, base + end, token_count))
+                yield Chunk(text=buffer[start:end], start_index=base + start, end_index=base + end, token_count=token_count)
+
+        for text in self.pages():
+            buffer = buffer + PAGE_SEPARATOR + text if len(self.page_offsets) > 1 else text
+            if len(buffer) < window_chars:
+                continue
+            with span("chunk", mode=self.config["mode"], streamed=True):
+                offsets = _window_offsets(buffer, self.config)
+            yield from emit(offsets[:-1])
+            keep = offsets[-1][0]
+            buffer, base = buffer[keep:], base + keep
+
+        if buffer:
+            with span("chunk", mode=self.config["mode"], streamed=True):
+                offsets = _window_offsets(buffer, self.config)
+            yield from emit(offsets)
+
+    def chunk_at(self, index: int) -> Chunk:
+        start, end, token_count = self.chunk_offsets[index]
+        first = bisect_right(self.page_offsets, start) - 1
+        last = bisect_left(self.page_offsets, end) - 1
+        pages = _extract_pages(self.source, self.page_numbers[first], self.page_numbers[last] + 1)
+        text = PAGE_SEPARATOR.join(pages)
+        base = self.page_offsets[first]
+        return Chunk(text=text[start - base:end - base], start_index=start, end_index=end, token_count=token_count)
+
+def load_and_chunk_pdf(source: PdfSource, use_cache: bool = TEXT_CACHE_ENABLED, pdf_hash: Optional[str] = None) -> Tuple[str, List]:
+    """Extract and chunk a PDF given as a path, its bytes or a binary stream.
+
+    In-memory PDFs are read where they are, nothing is written to disk.
+    """
+    source = pdf_source(source)
     print("Validating file size...")
-    validate_pdf_size(file_path, max_size_mb=10)
+    with span("validate"):
+        validate_pdf_size(source)
+
+    text = None
+    if use_cache:
+        pdf_hash = pdf_hash or hash_pdf(source)
+        text = text_cache.get_text(pdf_hash)
+        if text is not None:
+            offsets = text_cache.get_offsets(pdf_hash, CHUNKER_CONFIG_KEY)
+            if offsets is not None:
+                with span("chunk", cached=True, chunks=len(offsets)):
+                    chunks = chunks_from_offsets(text, offsets)
+                print(f"✅ Loaded {len(chunks)} cached chunks")
+                return text, chunks
 
-    print(f"Extracting text from {file_path}...")
-    text = extract_text_from_pdf(file_path)
+    if text is None:
+        print(f"Extracting text from {source if isinstance(source, str) else 'in-memory PDF'}...")
+        with span("extract") as attributes:
+            text = extract_text_from_pdf(source)
+            attributes["chars"] = len(text)
+        if use_cache:
+            text_cache.set_text(pdf_hash, text)
     
-    print("Chunking with Chonkie...")
-    chunks = chunk_text(text)
+    print(f"Chunking ({CHUNKER_CONFIG['mode']} mode)...")
+    with span("chunk", mode=CHUNKER_CONFIG['mode']) as attributes:
+        chunks = chunk_text(text)
+        attributes["chunks"] = len(chunks)
+
+    if use_cache:
+        offsets = chunk_offsets(text, chunks)
+        if offsets is not None:
+            text_cache.set_offsets(pdf_hash, CHUNKER_CONFIG_KEY, offsets)
+        else:
+            print("⚠️ Chunk boundaries do not map onto the text, skipping chunk cache")
     
     print(f"✅ Created {len(chunks)} chunks")
     return text, chunks
@@ -0,0 +1,146 @@
+import random
+import threading
+import time
+from typing import Callable, Optional, TypeVar
+import openai
+from core.config import (
+    LLM_BACKOFF_BASE_SECONDS, LLM_BACKOFF_MAX_SECONDS, LLM_MAX_RETRIES, OPENAI_RPM_LIMIT, OPENAI_TPM_LIMIT
+)
+
+T = TypeVar("T")
+
+RETRYABLE_ERRORS = (
+    openai.RateLimitError,
+    openai.APITimeoutError,
+    openai.APIConnectionError,
+    openai.InternalServerError
+)
+
+class TokenBucket:
+    """Refills `capacity` units per minute. Callers reserve up front and may go into debt,
+    then sleep until the debt is repaid, so waiters are served in arrival order."""
+
+    def __init__(self, capacity: int):
+        self.capacity = float(capacity)
+        self.rate = capacity / 60.0
+        self._level = float(capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._level = min(self.capacity, self._level + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def reserve(self, amount: float) -> float:
+        """Take `amount` units and return how many seconds to wait before using them."""
+        with self._lock:
+            self._refill()
+            # A single request larger than the bucket could never be served otherwise
+            self._level -= min(amount, self.capacity)
+            return max(0.0, -self._level / self.rate)
+
+    def adjust(self, amount: float):
+        """Give back (positive) or take (negative) units after the real usage is known."""
+        with self._lock:
+            self._refill()
+            self._level = min(self.capacity, self._level + amount)
+
+class RateLimiter:
+    """Process-wide RPM/TPM limiter shared by every session and job.
+
+    A limit of 0 disables that bucket.
+    """
+
+    def __init__(self, rpm: int = OPENAI_RPM_LIMIT, tpm: int = OPENAI_TPM_LIMIT):
+        self.requests = TokenBucket(rpm) if rpm > 0 else None
+        self.tokens = TokenBucket(tpm) if tpm > 0 else None
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def pause(self, seconds: float):
+        # After a 429 every caller backs off, not only the one that was rejected
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    def acquire(self, estimated_tokens: int) -> float:
+        """Block until a request of `estimated_tokens` fits both limits, returns the seconds waited."""
+        started = time.monotonic()
+        while True:
+            with self._lock:
+                paused = self._paused_until - time.monotonic()
+            if paused <= 0:
+                break
+            time.sleep(paused)
+
+        wait = 0.0
+        if self.requests is not None:
+            wait = max(wait, self.requests.reserve(1))
+        if self.tokens is not None:
+            wait = max(wait, self.tokens.reserve(estimated_tokens))
+        if wait > 0:
+            time.sleep(wait)
+        return time.monotonic() - started
+
+    def reconcile(self, estimated_tokens: int, actual_tokens: int):
+        if self.tokens is not None:
+            self.tokens.adjust(estimated_tokens - actual_tokens)
+
+    def refund(self, estimated_tokens: int):
+        # A failed attempt is not charged against the provider's TPM, so its reservation is given back
+        self.reconcile(estimated_tokens, 0)
+
+def retry_after_seconds(error: Exception) -> Optional[float]:
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        if headers.get("retry-after"):
+            return float(headers["retry-after"])
+    except ValueError:
+        pass
+    return None
+
+def backoff_delay(
+    attempt: int,
+    retry_after: Optional[float] = None,
+    base: float = LLM_BACKOFF_BASE_SECONDS,
+    cap: float = LLM_BACKOFF_MAX_SECONDS
+) -> float:
+    """Exponential backoff with jitter, never shorter than the server's Retry-After."""
+    ceiling = min(cap, base * 2 ** attempt)
+    delay = ceiling / 2 + random.uniform(0, ceiling / 2)
+    if retry_after is not None:
+        delay = max(delay, retry_after + random.uniform(0, base))
+    return delay
+
+def is_retryable(error: Exception) -> bool:
+    if getattr(error, "code", None) == "insufficient_quota":
+        return False
+    return isinstance(error, RETRYABLE_ERRORS)
+
+def call_with_retries(
+    fn: Callable[[], T],
+    estimated_tokens: int,
+    limiter: Optional[RateLimiter] = None,
+    max_retries: int = LLM_MAX_RETRIES
+) -> T:
+    """Run `fn` under the rate limiter, retrying rate limits, timeouts and 5xx errors."""
+    limiter = limiter or rate_limiter
+    for attempt in range(max_retries + 1):
+        limiter.acquire(estimated_tokens)
+        try:
+            return fn()
+        except Exception as e:
+            limiter.refund(estimated_tokens)
+            if attempt == max_retries or not is_retryable(e):
+                raise
+            retry_after = retry_after_seconds(e)
+            delay = backoff_delay(attempt, retry_after)
+            if isinstance(e, openai.RateLimitError):
+                limiter.pause(delay)
+            print(f"⏳ {type(e).__name__}, retrying in {delay:.1f}s (attempt {attempt + 2}/{max_retries + 1})")
+            time.sleep(delay)
+
+rate_limiter = RateLimiter()
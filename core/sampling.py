@@ -0,0 +1,50 @@
+import random
+from statistics import median
+from typing import List, Set
+from core.dedup import WORD_PATTERN, jaccard
+
+SAMPLING_STRATEGIES = ("sequential", "stratified", "diverse")
+
+def _strata(num_chunks: int, k: int) -> List[range]:
+    # k contiguous, near-equal runs of chunk positions covering the whole document
+    bounds = [round(i * num_chunks / k) for i in range(k + 1)]
+    return [range(bounds[i], bounds[i + 1]) for i in range(k)]
+
+def _vocabulary(text: str) -> Set[str]:
+    return {word for word in WORD_PATTERN.findall(text.lower()) if len(word) > 3}
+
+def select_chunks(texts: List[str], k: int, strategy: str = "stratified", seed: int = 0) -> List[int]:
+    """Pick `k` chunk indices spread over the document, in document order.
+
+    - "sequential": the first k chunks, the original behaviour
+    - "stratified": one chunk from each of k equal position ranges, chosen with `seed`
+    - "diverse": one chunk per range too, the one whose vocabulary overlaps the
+      chunks already picked the least; near-empty chunks (tables of contents,
+      blank pages) are only used when a range has nothing else
+
+    The same texts, k, strategy and seed always give the same selection.
+    """
+    if strategy not in SAMPLING_STRATEGIES:
+        raise ValueError(f"Unknown chunk sampling strategy: {strategy}")
+    if k >= len(texts):
+        return list(range(len(texts)))
+    if strategy == "sequential":
+        return list(range(k))
+
+    rng = random.Random(seed)
+    strata = _strata(len(texts), k)
+    if strategy == "stratified":
+        return [rng.choice(stratum) for stratum in strata]
+
+    vocabularies = [_vocabulary(text) for text in texts]
+    chosen = []
+    for stratum in strata:
+        candidates = list(stratum)
+        rng.shuffle(candidates)
+        floor = median(len(vocabularies[i]) for i in candidates) / 2
+        candidates = [i for i in candidates if len(vocabularies[i]) >= floor] or candidates
+        chosen.append(min(
+            candidates,
+            key=lambda i: max((jaccard(vocabularies[i], vocabularies[j]) for j in chosen), default=0.0)
+        ))
+    return chosen
@@ -0,0 +1,147 @@
+import os
+import socket
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Tuple
+
+# Spans of the document being processed on this thread, None outside a trace
+_current_spans: ContextVar[Optional[List[dict]]] = ContextVar("mcq_spans", default=None)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+TOKEN_BUCKETS = (100, 250, 500, 1000, 2000, 4000, 8000, 16000)
+CHUNK_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+def _label_key(label_names: Tuple[str, ...], labels: Dict[str, str]) -> Tuple[str, ...]:
+    return tuple(str(labels.get(name, "")) for name in label_names)
+
+def _format_labels(label_names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(label_names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+class Counter:
+    def __init__(self, name: str, help_text: str, label_names: Tuple[str, ...] = ()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        # Unlabelled counters are exported as 0 before their first increment
+        self._values: Dict[Tuple[str, ...], float] = {} if label_names else {(): 0}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = _label_key(self.label_names, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.label_names, key)} {value}")
+        return lines
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, buckets: Tuple[float, ...], label_names: Tuple[str, ...] = ()):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = tuple(sorted(buckets))
+        self.label_names = label_names
+        # label values -> (per-bucket counts with a trailing +Inf slot, sum, count)
+        self._series: Dict[Tuple[str, ...], List] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = _label_key(self.label_names, labels)
+        with self._lock:
+            series = self._series.setdefault(key, [[0] * (len(self.buckets) + 1), 0.0, 0])
+            series[0][bisect_left(self.buckets, value)] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, (counts, total, count) in sorted(self._series.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets, counts):
+                    cumulative += bucket_count
+                    labels = _format_labels(self.label_names, key, 'le="%s"' % bound)
+                    lines.append(f"{self.name}_bucket{labels} {cumulative}")
+                labels = _format_labels(self.label_names, key, 'le="+Inf"')
+                lines.append(f"{self.name}_bucket{labels} {count}")
+                labels = _format_labels(self.label_names, key)
+                lines.append(f"{self.name}_sum{labels} {total}")
+                lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+STAGE_SECONDS = Histogram(
+    "mcq_stage_duration_seconds", "Duration of pipeline stages", LATENCY_BUCKETS, ("stage",)
+)
+LLM_TOKENS = Histogram(
+    "mcq_llm_tokens_per_call", "Tokens per LLM call", TOKEN_BUCKETS, ("direction",)
+)
+CHUNKS_PER_DOCUMENT = Histogram(
+    "mcq_chunks_per_document", "Chunks produced per document", CHUNK_BUCKETS
+)
+LLM_FAILURES = Counter("mcq_llm_failures_total", "LLM calls that returned no questions because of an error")
+DOCUMENTS = Counter("mcq_documents_total", "Documents processed", ("source",))
+
+REGISTRY = [STAGE_SECONDS, LLM_TOKENS, CHUNKS_PER_DOCUMENT, LLM_FAILURES, DOCUMENTS]
+
+def render_metrics() -> str:
+    return "\n".join(line for metric in REGISTRY for line in metric.render()) + "\n"
+
+def write_metrics_file(path: str) -> None:
+    """Write this process's metrics to `path`, filling in its {host} and {pid} placeholders."""
+    try:
+        path = path.format(host=socket.gethostname(), pid=os.getpid())
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as f:
+            f.write(render_metrics())
+        os.replace(tmp_path, path)
+    except Exception as e:
+        print(f"⚠️ Failed to write metrics: {e}")
+
+@contextmanager
+def trace(spans: Optional[List[dict]] = None):
+    """Collect spans recorded on this thread into `spans` (a new list if omitted)."""
+    spans = [] if spans is None else spans
+    token = _current_spans.set(spans)
+    try:
+        yield spans
+    finally:
+        _current_spans.reset(token)
+
+def traced(spans: Optional[List[dict]], fn):
+    """Wrap `fn` so spans it records on a pool thread land in `spans`."""
+    def run(*args, **kwargs):
+        with trace(spans):
+            return fn(*args, **kwargs)
+    return run
+
+@contextmanager
+def span(name: str, **attributes):
+    """Time a stage, feed the stage histogram and, inside a trace, record the span.
+
+    The yielded dict can be filled with extra attributes before the block ends.
+    """
+    started_at = time.time()
+    start = time.perf_counter()
+    try:
+        yield attributes
+    finally:
+        duration = time.perf_counter() - start
+        STAGE_SECONDS.observe(duration, stage=name)
+        spans = _current_spans.get()
+        if spans is not None:
+            spans.append({
+                "name": name,
+                "start": started_at,
+                "duration_ms": round(duration * 1000, 3),
+                **({"attributes": attributes} if attributes else {})
+            })
@@ -0,0 +1,24 @@
+from functools import lru_cache
+from typing import List
+from core.config import OPENAI_MODEL
+import tiktoken
+
+DEFAULT_ENCODING = "cl100k_base"
+
+def encoding_name_for_model(model: str = OPENAI_MODEL) -> str:
+    try:
+        return tiktoken.encoding_name_for_model(model)
+    except KeyError:
+        return DEFAULT_ENCODING
+
+@lru_cache(maxsize=None)
+def get_encoding(model: str = OPENAI_MODEL) -> tiktoken.Encoding:
+    # Resolved once per model for the whole process, tiktoken's own lookup redoes the model->encoding match every call
+    return tiktoken.get_encoding(encoding_name_for_model(model))
+
+def count_tokens(text: str, model: str = OPENAI_MODEL) -> int:
+    return len(get_encoding(model).encode_ordinary(text))
+
+def count_tokens_batch(texts: List[str], model: str = OPENAI_MODEL, num_threads: int = 8) -> List[int]:
+    # tiktoken encodes batches on its own thread pool, outside the GIL
+    return [len(tokens) for tokens in get_encoding(model).encode_ordinary_batch(texts, num_threads=num_threads)]
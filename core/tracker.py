@@ -1,65 +1,358 @@
+import atexit
 import json
 import os
+import sqlite3
+import time
 from datetime import datetime
+from typing import List, Optional
 import threading
 
+DB_FILE = "data/usage.db"
+# Legacy summary, now a snapshot refreshed by the compactor rather than the source of truth
 STATS_FILE = "data/usage_stats.json"
+SNAPSHOT_INTERVAL_SECONDS = 30
+FLUSH_INTERVAL_SECONDS = 2.0
+FLUSH_BATCH_SIZE = 200
+
+INPUT_PRICE_PER_M = 2.50
+CACHED_INPUT_PRICE_PER_M = 1.25
+OUTPUT_PRICE_PER_M = 10.00
 
 class UsageTracker:
-    def __init__(self):
-        self._lock = threading.Lock()
-        self._ensure_file()
-
-    def _ensure_file(self):
-        os.makedirs(os.path.dirname(STATS_FILE), exist_ok=True)
-        if not os.path.exists(STATS_FILE):
-            with open(STATS_FILE, 'w') as f:
-                json.dump({
-                    "total_documents_processed": 0,
-                    "total_api_calls": 0,
-                    "tokens": {
-                        "input": 0,
-                        "output": 0,
-                        "total": 0
-                    },
-                    "costs": {
-                        "total_usd_est": 0.0,
-                        "avg_cost_per_doc": 0.0
-                    },
-                    "last_updated": None
-                }, f, indent=2)
-
-    def log_usage(self, input_tokens: int, output_tokens: int, is_new_document: bool = False):
-        with self._lock:
-            try:
-                # Read existing data
-                with open(STATS_FILE, 'r') as f:
-                    data = json.load(f)
-                
-                # Update counters
-                data["tokens"]["input"] += input_tokens
-                data["tokens"]["output"] += output_tokens
-                data["tokens"]["total"] += (input_tokens + output_tokens)
-                
-                if input_tokens > 0 or output_tokens > 0:
-                    data["total_api_calls"] += 1
-
-                if is_new_document:
-                    data["total_documents_processed"] += 1
-                
-                input_cost = (input_tokens / 1_000_000) * 2.50
-                output_cost = (output_tokens / 1_000_000) * 10.00
-                data["costs"]["total_usd_est"] += (input_cost + output_cost)
-                
-                if data["total_documents_processed"] > 0:
-                    data["costs"]["avg_cost_per_doc"] = data["costs"]["total_usd_est"] / data["total_documents_processed"]
-
-                data["last_updated"] = datetime.now().isoformat()
-                
-                with open(STATS_FILE, 'w') as f:
-                    json.dump(data, f, indent=2)
-                    
-            except Exception as e:
-                print(f"⚠️ Failed to log usage: {e}")
+    """Usage store safe across threads, processes and containers sharing ./data.
+
+    Every call appends one row to a WAL-mode SQLite database instead of
+    rewriting a JSON file, so concurrent writers never lose updates. Totals
+    are aggregated on read by `get_summary()`, and `write_snapshot()` keeps
+    `usage_stats.json` in its original shape for existing readers.
+
+    Logging never touches the disk on the request path: events are buffered
+    in memory and written in batches by a background thread every
+    `FLUSH_INTERVAL_SECONDS`, as soon as `FLUSH_BATCH_SIZE` events are
+    waiting, and once more at interpreter exit.
+    """
+
+    def __init__(self, db_path: str = DB_FILE, stats_file: str = STATS_FILE):
+        self.db_path = db_path
+        self.stats_file = stats_file
+        self._local = threading.local()
+        self._snapshot_lock = threading.Lock()
+        self._last_snapshot = 0.0
+        self._buffer_lock = threading.Lock()
+        self._usage_buffer = []
+        self._cache_buffer = []
+        self._flush_requested = threading.Event()
+        self._flusher = None
+        self._ensure_db()
+        atexit.register(self.flush)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _ensure_db(self):
+        os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+        conn = self._connect()
+        conn.executescript("""
+            CREATE TABLE IF NOT EXISTS usage_events (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                ts REAL NOT NULL,
+                input_tokens INTEGER NOT NULL DEFAULT 0,
+                output_tokens INTEGER NOT NULL DEFAULT 0,
+                api_calls INTEGER NOT NULL DEFAULT 0,
+                documents INTEGER NOT NULL DEFAULT 0,
+                cost_usd REAL NOT NULL DEFAULT 0,
+                document_hash TEXT,
+                chunk_index INTEGER,
+                latency_ms REAL,
+                cached_input_tokens INTEGER NOT NULL DEFAULT 0
+            );
+            CREATE TABLE IF NOT EXISTS cache_events (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                ts REAL NOT NULL,
+                cache TEXT NOT NULL,
+                hits INTEGER NOT NULL DEFAULT 0,
+                misses INTEGER NOT NULL DEFAULT 0
+            );
+            CREATE TABLE IF NOT EXISTS tracker_meta (
+                key TEXT PRIMARY KEY,
+                value TEXT
+            );
+        """)
+        # Databases created before per-call detail and cached-token accounting existed
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(usage_events)")}
+        for column, column_type in (
+            ("document_hash", "TEXT"),
+            ("chunk_index", "INTEGER"),
+            ("latency_ms", "REAL"),
+            ("cached_input_tokens", "INTEGER NOT NULL DEFAULT 0")
+        ):
+            if column not in columns:
+                conn.execute(f"ALTER TABLE usage_events ADD COLUMN {column} {column_type}")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_usage_events_document ON usage_events (document_hash)")
+        self._import_legacy_stats()
+
+    def _import_legacy_stats(self):
+        # Carry totals from the old JSON-only tracker over as a single seed event. The marker
+        # row is checked and written under the write lock, so processes starting together
+        # import it once, and databases that already have events are never seeded
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            imported = conn.execute("SELECT 1 FROM tracker_meta WHERE key = 'legacy_stats_imported'").fetchone()
+            has_events = conn.execute(
+                "SELECT EXISTS (SELECT 1 FROM usage_events) OR EXISTS (SELECT 1 FROM cache_events)"
+            ).fetchone()[0]
+            if not imported and not has_events:
+                self._insert_legacy_stats(conn)
+            conn.execute(
+                "INSERT OR IGNORE INTO tracker_meta (key, value) VALUES ('legacy_stats_imported', ?)", (str(time.time()),)
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _insert_legacy_stats(self, conn: sqlite3.Connection):
+        if not os.path.exists(self.stats_file):
+            return
+        try:
+            with open(self.stats_file, 'r') as f:
+                data = json.load(f)
+            usage = {
+                "input_tokens": data["tokens"]["input"],
+                "output_tokens": data["tokens"]["output"],
+                "api_calls": data["total_api_calls"],
+                "documents": data["total_documents_processed"],
+                "cost_usd": data["costs"]["total_usd_est"]
+            }
+            cache_rows = [
+                (name, counters.get("hits", 0), counters.get("misses", 0))
+                for name, counters in data.get("cache", {}).items()
+            ]
+        except Exception as e:
+            print(f"⚠️ Failed to import legacy usage stats: {e}")
+            return
+        self._append_usage(**usage)
+        conn.executemany(
+            "INSERT INTO cache_events (ts, cache, hits, misses) VALUES (?, ?, ?, ?)",
+            [(time.time(), *row) for row in cache_rows]
+        )
+
+    def _append_usage(self, input_tokens: int, output_tokens: int, api_calls: int, documents: int, cost_usd: float,
+                      document_hash: Optional[str] = None, chunk_index: Optional[int] = None,
+                      latency_ms: Optional[float] = None):
+        self._connect().execute(
+            """
+            INSERT INTO usage_events
+                (ts, input_tokens, output_tokens, api_calls, documents, cost_usd, document_hash, chunk_index, latency_ms)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+            (time.time(), input_tokens, output_tokens, api_calls, documents, cost_usd, document_hash, chunk_index, latency_ms)
+        )
+
+    def _enqueue(self, buffer: List, row: tuple):
+        with self._buffer_lock:
+            buffer.append(row)
+            pending = len(self._usage_buffer) + len(self._cache_buffer)
+            if self._flusher is None or not self._flusher.is_alive():
+                self._flusher = threading.Thread(target=self._flush_loop, name="usage-flush", daemon=True)
+                self._flusher.start()
+        if pending >= FLUSH_BATCH_SIZE:
+            self._flush_requested.set()
+
+    def _flush_loop(self):
+        while True:
+            self._flush_requested.wait(FLUSH_INTERVAL_SECONDS)
+            self._flush_requested.clear()
+            self.flush()
+            self.maybe_write_snapshot()
+
+    def flush(self):
+        with self._buffer_lock:
+            usage_rows, self._usage_buffer = self._usage_buffer, []
+            cache_rows, self._cache_buffer = self._cache_buffer, []
+        if not usage_rows and not cache_rows:
+            return
+
+        conn = None
+        try:
+            conn = self._connect()
+            conn.execute("BEGIN IMMEDIATE")
+            conn.executemany(
+                """
+                INSERT INTO usage_events
+                    (ts, input_tokens, output_tokens, api_calls, documents, cost_usd, document_hash, chunk_index, latency_ms,
+                     cached_input_tokens)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                usage_rows
+            )
+            conn.executemany("INSERT INTO cache_events (ts, cache, hits, misses) VALUES (?, ?, ?, ?)", cache_rows)
+            conn.execute("COMMIT")
+        except Exception as e:
+            print(f"⚠️ Failed to flush {len(usage_rows) + len(cache_rows)} usage events: {e}")
+            if conn is not None and conn.in_transaction:
+                conn.execute("ROLLBACK")
+            # Put them back so the next flush retries
+            with self._buffer_lock:
+                self._usage_buffer[:0] = usage_rows
+                self._cache_buffer[:0] = cache_rows
+
+    def log_usage(
+        self,
+        input_tokens: int,
+        output_tokens: int,
+        is_new_document: bool = False,
+        document_hash: Optional[str] = None,
+        chunk_index: Optional[int] = None,
+        latency_ms: Optional[float] = None,
+        cached_input_tokens: int = 0
+    ):
+        # cached_input_tokens is the part of input_tokens served from the provider's prompt cache
+        input_cost = (
+            (input_tokens - cached_input_tokens) * INPUT_PRICE_PER_M + cached_input_tokens * CACHED_INPUT_PRICE_PER_M
+        ) / 1_000_000
+        output_cost = (output_tokens / 1_000_000) * OUTPUT_PRICE_PER_M
+        self._enqueue(self._usage_buffer, (
+            time.time(),
+            input_tokens,
+            output_tokens,
+            1 if input_tokens > 0 or output_tokens > 0 else 0,
+            1 if is_new_document else 0,
+            input_cost + output_cost,
+            document_hash,
+            chunk_index,
+            latency_ms,
+            cached_input_tokens
+        ))
+
+    def log_cache(self, cache_name: str, hit: bool):
+        self._enqueue(self._cache_buffer, (time.time(), cache_name, int(hit), int(not hit)))
+
+    def get_summary(self, since: Optional[float] = None) -> dict:
+        """Totals over all recorded usage, or only events from `since` (a timestamp) on."""
+        self.flush()
+        conn = self._connect()
+        since = since or 0.0
+        input_tokens, cached_input_tokens, output_tokens, api_calls, documents, cost, last_ts = conn.execute("""
+            SELECT COALESCE(SUM(input_tokens), 0), COALESCE(SUM(cached_input_tokens), 0), COALESCE(SUM(output_tokens), 0),
+                   COALESCE(SUM(api_calls), 0), COALESCE(SUM(documents), 0),
+                   COALESCE(SUM(cost_usd), 0), MAX(ts)
+            FROM usage_events
+            WHERE ts >= ?
+        """, (since,)).fetchone()
+
+        # Calls with and without a prompt cache hit, to see what the prefix cache buys in latency
+        latency = {
+            hit: average
+            for hit, average in conn.execute("""
+                SELECT cached_input_tokens > 0, AVG(latency_ms)
+                FROM usage_events
+                WHERE api_calls > 0 AND latency_ms IS NOT NULL AND ts >= ?
+                GROUP BY cached_input_tokens > 0
+            """, (since,))
+        }
+
+        cache = {}
+        for name, hits, misses in conn.execute(
+            "SELECT cache, SUM(hits), SUM(misses) FROM cache_events WHERE ts >= ? GROUP BY cache", (since,)
+        ):
+            cache[name] = {"hits": hits, "misses": misses, "hit_rate": hits / (hits + misses) if hits + misses else 0.0}
+
+        return {
+            "total_documents_processed": documents,
+            "total_api_calls": api_calls,
+            "tokens": {
+                "input": input_tokens,
+                "cached_input": cached_input_tokens,
+                "output": output_tokens,
+                "total": input_tokens + output_tokens
+            },
+            "costs": {
+                "total_usd_est": cost,
+                "avg_cost_per_doc": cost / documents if documents else 0.0,
+                "prompt_cache_savings_usd_est": cached_input_tokens * (INPUT_PRICE_PER_M - CACHED_INPUT_PRICE_PER_M) / 1_000_000
+            },
+            "cache": cache,
+            "prompt_cache": {
+                "cached_input_share": cached_input_tokens / input_tokens if input_tokens else 0.0,
+                "avg_latency_ms_cached": latency.get(1),
+                "avg_latency_ms_uncached": latency.get(0)
+            },
+            "last_updated": datetime.fromtimestamp(last_ts).isoformat() if last_ts else None
+        }
+
+    def document_costs(self, limit: int = 10) -> List[dict]:
+        """Most expensive documents first, with per-document call, token and latency totals."""
+        self.flush()
+        rows = self._connect().execute("""
+            SELECT document_hash, SUM(api_calls), COUNT(chunk_index), SUM(input_tokens), SUM(cached_input_tokens),
+                   SUM(output_tokens), SUM(cost_usd), SUM(latency_ms), MAX(latency_ms), MAX(ts)
+            FROM usage_events
+            WHERE document_hash IS NOT NULL
+            GROUP BY document_hash
+            ORDER BY SUM(cost_usd) DESC
+            LIMIT ?
+        """, (limit,)).fetchall()
+        return [
+            {
+                "document_hash": document_hash,
+                "api_calls": api_calls,
+                "chunks": chunks,
+                "input_tokens": input_tokens,
+                "cached_input_tokens": cached_input_tokens,
+                "output_tokens": output_tokens,
+                "cost_usd": cost,
+                "total_latency_ms": total_latency,
+                "max_latency_ms": max_latency,
+                "last_seen": datetime.fromtimestamp(last_ts).isoformat()
+            }
+            for (document_hash, api_calls, chunks, input_tokens, cached_input_tokens, output_tokens, cost,
+                 total_latency, max_latency, last_ts) in rows
+        ]
+
+    def document_calls(self, document_hash: str) -> List[dict]:
+        self.flush()
+        rows = self._connect().execute("""
+            SELECT ts, chunk_index, input_tokens, cached_input_tokens, output_tokens, cost_usd, latency_ms
+            FROM usage_events
+            WHERE document_hash = ? AND chunk_index IS NOT NULL
+            ORDER BY ts
+        """, (document_hash,)).fetchall()
+        return [
+            {
+                "ts": datetime.fromtimestamp(ts).isoformat(),
+                "chunk_index": chunk_index,
+                "input_tokens": input_tokens,
+                "cached_input_tokens": cached_input_tokens,
+                "output_tokens": output_tokens,
+                "cost_usd": cost,
+                "latency_ms": latency_ms
+            }
+            for ts, chunk_index, input_tokens, cached_input_tokens, output_tokens, cost, latency_ms in rows
+        ]
+
+    def write_snapshot(self):
+        try:
+            tmp_path = f"{self.stats_file}.{os.getpid()}.tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump(self.get_summary(), f, indent=2)
+            os.replace(tmp_path, self.stats_file)
+        except Exception as e:
+            print(f"⚠️ Failed to write usage snapshot: {e}")
+
+    def maybe_write_snapshot(self):
+        # Periodic compaction, at most once per interval per process
+        with self._snapshot_lock:
+            if time.time() - self._last_snapshot < SNAPSHOT_INTERVAL_SECONDS:
+                return
+            self._last_snapshot = time.time()
+        self.write_snapshot()
 
 tracker = UsageTracker()
@@ -1,7 +1,5 @@
 import streamlit as st
-import os
 from services.langflow_service import upload_pdf, generate_mcqs_from_langflow
-import tempfile
 
 st.set_page_config(
     page_title="MCQ Agent",
@@ -187,11 +185,6 @@ if not st.session_state.quiz_data:
             st.info(f"📄 {uploaded_file.name} ({file_size_mb:.2f}MB)")
             
             if st.button("Generate Quiz"):
-                # Save uploaded file temporarily
-                with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as tmp_file:
-                    tmp_file.write(uploaded_file.getvalue())
-                    tmp_path = tmp_file.name
-                
                 try:
                     with st.spinner("Generating questions from Langflow..."):
                         langflow_file_path = upload_pdf(uploaded_file)
@@ -211,10 +204,6 @@ if not st.session_state.quiz_data:
                 
                 except Exception as e:
                     st.error(f"Error: {str(e)}")
-                
-                finally:
-                    if os.path.exists(tmp_path):
-                        os.unlink(tmp_path)
 
 # Quiz Interface
 elif st.session_state.quiz_data and not st.session_state.quiz_submitted:
@@ -1,45 +1,197 @@
+"""Batch-generate quiz banks from PDFs.
+
+    python main.py docs/ "courses/**/*.pdf" --num-questions 20 --workers 4 --output quiz_bank.jsonl
+
+Documents run in parallel worker processes, each with its own concurrent chunk
+calls, and every finished document is appended to --output as one JSON line.
+A manifest next to the output records finished documents, so rerunning the same
+command after a crash skips them and only processes the rest.
+"""
+import argparse
+import contextlib
+import glob
+import io
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Dict, List, Optional, Set, Tuple
 from dotenv import load_dotenv
+from core.config import MCQ_MAX_CONCURRENCY, OPENAI_RPM_LIMIT, OPENAI_TPM_LIMIT
+from core.pdf_processor import hash_pdf
+from core.tracker import tracker
 from services.mcq_service import generate_mcqs_from_pdf
 
 load_dotenv()
 
-def main():
+def expand_inputs(inputs: List[str]) -> List[str]:
+    """PDF paths from files, directories (searched recursively) and glob patterns, in a stable order."""
+    paths = []
+    for item in inputs:
+        if os.path.isdir(item):
+            matches = glob.glob(os.path.join(item, "**", "*.pdf"), recursive=True)
+        elif glob.has_magic(item):
+            matches = glob.glob(item, recursive=True)
+        else:
+            matches = [item]
+        paths.extend(sorted(path for path in matches if path.lower().endswith(".pdf")))
+    return list(dict.fromkeys(os.path.normpath(path) for path in paths))
+
+def read_manifest(manifest_path: str) -> Tuple[Set[Tuple[str, int]], Optional[int]]:
+    """Finished (sha256, num_questions) pairs and the output size recorded by the last entry."""
+    finished, output_end = set(), None
+    if not os.path.exists(manifest_path):
+        return finished, output_end
+    with open(manifest_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                # A line cut short by a crash
+                continue
+            if entry.get("status") == "done":
+                finished.add((entry["sha256"], entry["num_questions"]))
+            output_end = entry.get("output_end", output_end)
+    return finished, output_end
+
+def write_manifest_entry(manifest, entry: Dict):
+    manifest.write(json.dumps(entry) + "\n")
+    manifest.flush()
+    os.fsync(manifest.fileno())
+
+def process_document(path: str, num_questions: int, max_concurrency: int, use_cache: bool, verbose: bool) -> Dict:
+    """Runs in a worker process, returns the document's output record."""
+    started = time.time()
+    record = {"path": path, "num_questions": num_questions}
+    try:
+        with contextlib.nullcontext() if verbose else contextlib.redirect_stdout(io.StringIO()):
+            result = generate_mcqs_from_pdf(
+                path, num_questions, max_concurrency, use_cache=use_cache, use_chunk_cache=use_cache
+            )
+        metadata = dict(result["metadata"])
+        stage_seconds = {}
+        for recorded in metadata.pop("spans", []):
+            stage_seconds[recorded["name"]] = stage_seconds.get(recorded["name"], 0.0) + recorded["duration_ms"] / 1000
+        record.update(questions=result["questions"], metadata={**metadata, "stage_seconds": stage_seconds})
+    except Exception as e:
+        record["error"] = f"{type(e).__name__}: {e}"
+    finally:
+        # Pool workers exit without running atexit handlers
+        tracker.flush()
+    record["elapsed_seconds"] = round(time.time() - started, 3)
+    return record
+
+def print_summary(done: int, failed: int, skipped: int, questions: int, elapsed: float, started_at: float):
+    usage = tracker.get_summary(since=started_at)
+    minutes = max(elapsed, 1e-9) / 60
     print("\n" + "="*80)
-    print("MCQ Learning Assistant")
-    print("="*80 + "\n")
-    
-    # Configuration
-    pdf_path = "docs/before-the-coffee-gets-cold.pdf" 
-    num_questions = 10
-    
-    print(f"📄 PDF: {pdf_path}")
-    print(f"❓ Questions: {num_questions}")
-    
-    # Generate MCQs using the service
-    result = generate_mcqs_from_pdf(
-        pdf_path=pdf_path,
-        num_questions=num_questions
+    print(f"Documents: {done} done, {failed} failed, {skipped} skipped (finished earlier or duplicate content)")
+    print(f"Questions: {questions}")
+    print(f"Wall time: {elapsed:.1f}s ({done / minutes:.2f} documents/min, {questions / minutes:.1f} questions/min)")
+    print(
+        f"LLM calls: {usage['total_api_calls']}, tokens: {usage['tokens']['input']} in "
+        f"({usage['tokens']['cached_input']} cached) / {usage['tokens']['output']} out"
     )
-    
-    mcqs = result["questions"]
-    
-    # Show questions
-    for i, mcq in enumerate(mcqs, 1):
-        print(f"\n{'='*80}")
-        print(f"Question {i} [{mcq['difficulty']}]")
-        print('='*80)
-        print(f"\n{mcq['question']}\n")
-        
-        for option in mcq['options']:
-            print(f"  {option}")
-        
-        print(f"\n✓ Answer: {mcq['correct_answer']}")
-        print(f"💡 Hint: {mcq['hint']}")
-        print(f"📖 Explanation: {mcq['explanation']}")
-    
+    print(
+        f"Cost: ${usage['costs']['total_usd_est']:.4f} est. "
+        f"(${usage['costs']['total_usd_est'] / done if done else 0.0:.4f} per document)"
+    )
+    print("="*80 + "\n")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("inputs", nargs="+", help="PDF files, directories or glob patterns")
+    parser.add_argument("-n", "--num-questions", type=int, default=10, help="Questions per document")
+    parser.add_argument("-o", "--output", default="quiz_bank.jsonl", help="JSONL file, one record per document")
+    parser.add_argument("--manifest", help="Checkpoint manifest (default: <output>.manifest.jsonl)")
+    parser.add_argument("-w", "--workers", type=int, default=2, help="Documents processed in parallel")
+    parser.add_argument("-c", "--concurrency", type=int, default=MCQ_MAX_CONCURRENCY, help="Concurrent LLM calls per document")
+    parser.add_argument("--no-cache", action="store_true", help="Skip the result and chunk caches")
+    parser.add_argument("--fresh", action="store_true", help="Ignore the manifest and overwrite --output")
+    parser.add_argument("-v", "--verbose", action="store_true", help="Show each document's pipeline output")
+    args = parser.parse_args()
+
+    manifest_path = args.manifest or f"{args.output}.manifest.jsonl"
+    if args.fresh:
+        for path in (args.output, manifest_path):
+            if os.path.exists(path):
+                os.unlink(path)
+
+    paths = expand_inputs(args.inputs)
+    finished, output_end = read_manifest(manifest_path)
+    if output_end is not None and os.path.exists(args.output) and os.path.getsize(args.output) > output_end:
+        # Drop records written after the last manifest entry, they are regenerated below
+        with open(args.output, 'r+b') as f:
+            f.truncate(output_end)
+
+    todo, seen, unreadable = [], set(), []
+    for path in paths:
+        try:
+            key = (hash_pdf(path), args.num_questions)
+        except OSError as e:
+            unreadable.append((path, f"{type(e).__name__}: {e}"))
+            continue
+        if key in finished or key in seen:
+            continue
+        seen.add(key)
+        todo.append((path, key[0]))
+    skipped = len(paths) - len(todo) - len(unreadable)
+
     print("\n" + "="*80)
-    print("✨ Done!")
+    print("MCQ Learning Assistant - batch")
     print("="*80 + "\n")
+    print(f"📄 PDFs: {len(paths)} ({len(todo)} to process, {skipped} skipped, {len(unreadable)} unreadable)")
+    print(f"❓ Questions per document: {args.num_questions}")
+    print(f"⚙️ Workers: {args.workers} x {args.concurrency} concurrent calls")
+
+    # Spawned workers read these at import: documents already run in parallel, so each
+    # extracts its PDF in-process, and the provider limits are split between the workers
+    workers = max(1, min(args.workers, len(todo) or 1))
+    os.environ.setdefault("PDF_EXTRACT_WORKERS", "1")
+    if OPENAI_RPM_LIMIT > 0:
+        os.environ["OPENAI_RPM_LIMIT"] = str(max(1, OPENAI_RPM_LIMIT // workers))
+    if OPENAI_TPM_LIMIT > 0:
+        os.environ["OPENAI_TPM_LIMIT"] = str(max(1, OPENAI_TPM_LIMIT // workers))
+
+    started_at = time.time()
+    done = questions = 0
+    failed = len(unreadable)
+    for path, error in unreadable:
+        print(f"❌ {path}: {error}")
+    with open(args.output, 'a', encoding='utf-8') as output, open(manifest_path, 'a', encoding='utf-8') as manifest, \
+            ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        # Where this run starts writing, so a crash before its first document still rolls back to here
+        write_manifest_entry(manifest, {"status": "started", "output_end": output.tell(), "started_at": started_at})
+        futures = {
+            pool.submit(process_document, path, args.num_questions, args.concurrency, not args.no_cache, args.verbose): sha256
+            for path, sha256 in todo
+        }
+        for finished_count, future in enumerate(as_completed(futures), 1):
+            record = {"sha256": futures[future], **future.result()}
+            position = f"[{finished_count}/{len(todo)}]"
+            if "error" in record:
+                failed += 1
+                print(f"{position} ❌ {record['path']}: {record['error']}")
+            else:
+                done += 1
+                questions += len(record["questions"])
+                output.write(json.dumps(record, ensure_ascii=False) + "\n")
+                output.flush()
+                os.fsync(output.fileno())
+                print(f"{position} ✓ {record['path']}: {len(record['questions'])} questions in {record['elapsed_seconds']:.1f}s")
+
+            # The record is on disk before the manifest says so, a crash in between only repeats this document
+            write_manifest_entry(manifest, {
+                "sha256": record["sha256"],
+                "num_questions": args.num_questions,
+                "path": record["path"],
+                "status": "failed" if "error" in record else "done",
+                "output_end": output.tell(),
+                "finished_at": time.time()
+            })
+
+    print_summary(done, failed, skipped, questions, time.time() - started_at, started_at)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,213 @@
+import asyncio
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, Dict, Hashable, Iterator, List, Optional
+from core.config import JOB_QUEUE_SIZE, JOB_TTL_MINUTES, JOB_WORKERS
+from core.pdf_processor import PdfSource
+from services.mcq_service import stream_mcqs_from_pdf
+
+class JobQueueFull(Exception):
+    pass
+
+class Job:
+    def __init__(self, pdf_path: PdfSource, num_questions: int, regenerate: bool = False):
+        self.id = uuid.uuid4().hex
+        self.pdf_path = pdf_path
+        self.num_questions = num_questions
+        self.regenerate = regenerate
+        self.status = "queued"
+        self.questions: List[dict] = []
+        self.progress: Optional[dict] = None
+        self.metadata: Optional[dict] = None
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.events: List[dict] = []
+        self._changed = threading.Condition()
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ("done", "failed")
+
+    @property
+    def elapsed_seconds(self) -> float:
+        if self.started_at is None:
+            return 0.0
+        return (self.finished_at or time.time()) - self.started_at
+
+    @property
+    def eta_seconds(self) -> Optional[float]:
+        # Extrapolated from the share of questions ready so far
+        if self.finished:
+            return 0.0
+        if not self.questions:
+            return None
+        remaining = max(0, self.num_questions - len(self.questions))
+        return self.elapsed_seconds * remaining / len(self.questions)
+
+    def _publish(self, event: dict):
+        with self._changed:
+            if event["type"] == "question":
+                self.questions.append(event["question"])
+            elif event["type"] in ("start", "progress"):
+                self.progress = event
+            elif event["type"] == "done":
+                self.metadata = event["result"]["metadata"]
+            self.events.append(event)
+            self._changed.notify_all()
+
+    def _set_status(self, status: str, error: Optional[str] = None):
+        with self._changed:
+            self.status = status
+            self.error = error
+            if status == "running":
+                self.started_at = time.time()
+            if self.finished:
+                self.finished_at = time.time()
+            self._changed.notify_all()
+
+    def iter_events(self, heartbeat_seconds: float = 15.0) -> Iterator[Optional[dict]]:
+        """Replay past events, then follow new ones until the job finishes. Yields None as a heartbeat."""
+        position = 0
+        while True:
+            with self._changed:
+                if position >= len(self.events) and not self.finished:
+                    self._changed.wait(heartbeat_seconds)
+                new_events = self.events[position:]
+                finished = self.finished
+            position += len(new_events)
+
+            if not new_events and not finished:
+                yield None
+            yield from new_events
+            if finished and position >= len(self.events):
+                return
+
+    async def aiter_events(self, heartbeat_seconds: float = 15.0, poll_seconds: float = 0.2) -> AsyncIterator[Optional[dict]]:
+        """`iter_events` for asyncio code, polling instead of blocking so an idle subscriber holds no thread."""
+        position = 0
+        last_sent = time.monotonic()
+        while True:
+            with self._changed:
+                new_events = self.events[position:]
+                finished = self.finished
+            position += len(new_events)
+
+            for event in new_events:
+                yield event
+            if finished and position >= len(self.events):
+                return
+            if new_events:
+                last_sent = time.monotonic()
+            elif time.monotonic() - last_sent >= heartbeat_seconds:
+                yield None
+                last_sent = time.monotonic()
+            await asyncio.sleep(poll_seconds)
+
+    def to_dict(self) -> Dict:
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "num_questions": self.num_questions,
+            "regenerate": self.regenerate,
+            "questions": list(self.questions),
+            "progress": self.progress,
+            "metadata": self.metadata,
+            "error": self.error,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "elapsed_seconds": self.elapsed_seconds,
+            "eta_seconds": self.eta_seconds
+        }
+
+class JobManager:
+    """Runs generation jobs on a bounded worker pool.
+
+    At most `max_workers` jobs run at once and `max_queued` more may wait;
+    beyond that `submit` raises `JobQueueFull` so callers can push back
+    instead of piling up work. Finished jobs are kept for `ttl_seconds`.
+
+    Submitting with a `dedupe_key` already used by an unfinished job returns
+    that job instead of starting a second, identical (and separately billed) run.
+    """
+
+    def __init__(self, max_workers: int, max_queued: int, ttl_seconds: int):
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="mcq-job")
+        self._slots = threading.BoundedSemaphore(max_workers + max_queued)
+        self._ttl_seconds = ttl_seconds
+        self._jobs: Dict[str, Job] = {}
+        self._in_flight: Dict[Hashable, Job] = {}
+        self._lock = threading.Lock()
+
+    def submit(
+        self,
+        pdf_path: PdfSource,
+        num_questions: int,
+        dedupe_key: Optional[Hashable] = None,
+        regenerate: bool = False
+    ) -> Job:
+        """Queue a job, `regenerate=True` asks for new questions instead of cached ones."""
+        # A regenerate request must not attach to a run that may serve cached questions
+        if dedupe_key is not None and regenerate:
+            dedupe_key = (dedupe_key, "regenerate")
+        with self._lock:
+            if dedupe_key is not None:
+                running = self._in_flight.get(dedupe_key)
+                if running is not None and not running.finished:
+                    print(f"♻️ Attaching to in-flight job {running.id}")
+                    return running
+
+            if not self._slots.acquire(blocking=False):
+                raise JobQueueFull("Too many generation jobs in progress, retry later")
+
+            job = Job(pdf_path, num_questions, regenerate)
+            self._evict_expired()
+            self._jobs[job.id] = job
+            if dedupe_key is not None:
+                self._in_flight[dedupe_key] = job
+
+        self._pool.submit(self._run, job, dedupe_key)
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def _run(self, job: Job, dedupe_key: Optional[Hashable] = None):
+        job._set_status("running")
+        try:
+            for event in stream_mcqs_from_pdf(
+                pdf_path=job.pdf_path, num_questions=job.num_questions, regenerate=job.regenerate
+            ):
+                job._publish(event)
+            job._set_status("done")
+        except Exception as e:
+            print(f"❌ Job {job.id} failed: {e}")
+            job._set_status("failed", error=str(e))
+        finally:
+            # Finished jobs are kept for their results, not for an in-memory upload
+            if not isinstance(job.pdf_path, str):
+                job.pdf_path = None
+            with self._lock:
+                if dedupe_key is not None and self._in_flight.get(dedupe_key) is job:
+                    del self._in_flight[dedupe_key]
+            self._slots.release()
+
+    def _evict_expired(self):
+        now = time.time()
+        expired = [
+            job_id for job_id, job in self._jobs.items()
+            if job.finished and now - job.finished_at > self._ttl_seconds
+        ]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+job_manager = JobManager(
+    max_workers=JOB_WORKERS,
+    max_queued=JOB_QUEUE_SIZE,
+    ttl_seconds=JOB_TTL_MINUTES * 60
+)
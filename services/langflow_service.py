@@ -1,51 +1,318 @@
-import requests
+import asyncio
+import json
+import os
+import re
+import threading
+import time
 import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+import httpx
+from pydantic import ValidationError
+from core.config import (
+    LANGFLOW_API_KEY, LANGFLOW_BASE_URL, LANGFLOW_CONNECT_TIMEOUT_SECONDS, LANGFLOW_FILE_COMPONENT, LANGFLOW_FLOW_ID,
+    LANGFLOW_MAX_CONCURRENT_RUNS, LANGFLOW_MAX_CONNECTIONS, LANGFLOW_MAX_RETRIES, LANGFLOW_PROMPT_COMPONENT,
+    LANGFLOW_QUESTIONS_PER_RUN, LANGFLOW_READ_TIMEOUT_SECONDS
+)
+from core.dedup import QuestionDeduper
+from core.models import MCQQuestion
+from core.pdf_processor import PdfSource, hash_pdf, open_pdf_stream
+from core.ratelimit import backoff_delay, retry_after_seconds
 
-LANGFLOW_API_KEY = "sk-8zTqhnMe8iNesxvqtBpR3dsBwpUCyKBQvHM-Q4s68iA"
-BASE_URL = "http://172.17.0.1:7860"
-FLOW_ID = "17f0755a-bee6-4380-8f1d-84aef615ac0d"
+# Uploads are deduplicated, so retrying them is safe. A gateway 502/504 on a flow run
+# usually means the flow is still running, so runs retry only rejections
+RETRYABLE_STATUS = (429, 502, 503, 504)
+RUN_RETRYABLE_STATUS = (429, 503)
+# Flow output is often wrapped in a markdown code fence
+CODE_FENCE = re.compile(r"^```(?:json)?\s*|\s*```$")
+# Only errors raised before the server could have started a flow run, retrying
+# after a read timeout would run the flow (and bill its LLM calls) twice
+RETRYABLE_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout, httpx.RemoteProtocolError)
 
-headers = {"x-api-key": LANGFLOW_API_KEY}
+# (server URL, content hash) -> path on that Langflow server, shared by every client in the process
+_server_paths: Dict[Tuple[str, str], str] = {}
+_server_paths_lock = threading.Lock()
 
-def upload_pdf(file):
-    response = requests.post(
-        f"{BASE_URL}/api/v2/files",
-        headers=headers,
-        files={"file": file}
-    )
-    response.raise_for_status()
-    print(f"FILE PATH: {response.json()}")
-    return response.json()["path"]
+def _is_retryable(error: Exception, retry_status: Tuple[int, ...] = RETRYABLE_STATUS) -> bool:
+    if isinstance(error, httpx.HTTPStatusError):
+        return error.response.status_code in retry_status
+    return isinstance(error, RETRYABLE_ERRORS)
 
-def generate_mcqs_from_langflow(pdf_path, num_questions=5):
-    session_id = str(uuid.uuid4())
+def _is_missing_file(error: Exception) -> bool:
+    # The server no longer has an uploaded file, Langflow answers with a "not found" error
+    if not isinstance(error, httpx.HTTPStatusError) or error.response.status_code < 400:
+        return False
+    return error.response.status_code == 404 or "not found" in error.response.text.lower()
 
-    payload = {
+def _file_name(file: PdfSource) -> str:
+    name = getattr(file, "name", None) or (file if isinstance(file, (str, os.PathLike)) else "upload.pdf")
+    return os.path.basename(os.fspath(name))
+
+def _known_server_path(base_url: str, file_hash: str) -> Optional[str]:
+    with _server_paths_lock:
+        server_path = _server_paths.get((base_url, file_hash))
+    if server_path is not None:
+        print(f"♻️ Langflow already has this PDF: {server_path}")
+    return server_path
+
+def _remember_server_path(base_url: str, file_hash: str, server_path: str):
+    print(f"📤 Uploaded PDF to Langflow: {server_path}")
+    with _server_paths_lock:
+        _server_paths[(base_url, file_hash)] = server_path
+
+def _forget_server_path(base_url: str, server_path: str):
+    # The next upload_pdf of that content sends it again
+    with _server_paths_lock:
+        stale = [key for key, path in _server_paths.items() if key[0] == base_url and path == server_path]
+        for key in stale:
+            del _server_paths[key]
+    if stale:
+        print(f"🗑️ Langflow no longer has {server_path}, it will be uploaded again")
+
+def _run_payload(server_path: str, num_questions: int, session_id: Optional[str] = None) -> Dict:
+    return {
         "output_type": "chat",
         "input_type": "text",
         "input_value": f"Generate {num_questions} questions",
-        "session_id": session_id,
+        "session_id": session_id or str(uuid.uuid4()),
         "tweaks": {
-            "File-hacxY": {
-                "path": [pdf_path]
+            LANGFLOW_FILE_COMPONENT: {
+                "path": [server_path]
             },
-            "PromptNodeIdIfAny": {
+            LANGFLOW_PROMPT_COMPONENT: {
                 "count": num_questions
             }
         }
     }
 
-    response = requests.post(
-        f"{BASE_URL}/api/v1/run/{FLOW_ID}",
-        headers={"Content-Type": "application/json", **headers},
-        json=payload
-    )
-    print("STATUS", response.status_code)
-    print("BODY", response.text)
+def _message_content(data: Dict):
+    return data["outputs"][0]["outputs"][0]["results"]["message"]["data"]["content"]
+
+def parse_flow_questions(content) -> List[MCQQuestion]:
+    """Read the questions out of a flow's message content.
+
+    Accepts a JSON string (fenced or not), a list of questions or an
+    MCQList-shaped dict. Questions that fail validation are skipped.
+    """
+    if isinstance(content, str):
+        content = json.loads(CODE_FENCE.sub("", content.strip()))
+    if isinstance(content, dict):
+        content = content.get("questions", [])
+
+    questions = []
+    for item in content:
+        try:
+            questions.append(MCQQuestion.model_validate(item))
+        except ValidationError as e:
+            print(f"⚠️ Skipping invalid Langflow question: {e.errors()[0]['msg']}")
+    return questions
+
+def split_question_count(num_questions: int, questions_per_run: int) -> List[int]:
+    """Near-equal run sizes of at most `questions_per_run` adding up to `num_questions`."""
+    if questions_per_run <= 0:
+        return [num_questions]
+    num_runs = max(1, -(-num_questions // questions_per_run))
+    return [num_questions // num_runs + (1 if i < num_questions % num_runs else 0) for i in range(num_runs)]
+
+class _LangflowClientBase:
+    def __init__(
+        self,
+        base_url: str = LANGFLOW_BASE_URL,
+        flow_id: str = LANGFLOW_FLOW_ID,
+        api_key: str = LANGFLOW_API_KEY,
+        connect_timeout: float = LANGFLOW_CONNECT_TIMEOUT_SECONDS,
+        read_timeout: float = LANGFLOW_READ_TIMEOUT_SECONDS,
+        max_retries: int = LANGFLOW_MAX_RETRIES,
+        max_connections: int = LANGFLOW_MAX_CONNECTIONS
+    ):
+        self.base_url = base_url
+        self.flow_id = flow_id
+        self.max_retries = max_retries
+        self._client_options = {
+            "base_url": base_url,
+            "headers": {"x-api-key": api_key} if api_key else {},
+            "timeout": httpx.Timeout(read_timeout, connect=connect_timeout),
+            "limits": httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+        }
+
+    def _retry_delay(self, error: Exception, attempt: int, retry_status: Tuple[int, ...]) -> Optional[float]:
+        """Seconds to wait before retrying after `error`, or None to give up."""
+        if attempt == self.max_retries or not _is_retryable(error, retry_status):
+            return None
+        delay = backoff_delay(attempt, retry_after_seconds(error))
+        print(f"⏳ Langflow {type(error).__name__}, retrying in {delay:.1f}s (attempt {attempt + 2}/{self.max_retries + 1})")
+        return delay
+
+class LangflowClient(_LangflowClientBase):
+    """Langflow API client over one pooled, keep-alive HTTP session.
+
+    Uploads are deduplicated by content hash: a PDF the server already has
+    is not sent again. Connection errors and 429/503s are retried with backoff
+    (uploads also on 502/504), timeouts are split into connect and read.
+    """
+
+    def __init__(self, **settings):
+        super().__init__(**settings)
+        self._http = httpx.Client(**self._client_options)
+
+    def _request(
+        self, send: Callable[[], httpx.Response], retry_status: Tuple[int, ...] = RETRYABLE_STATUS
+    ) -> httpx.Response:
+        attempt = 0
+        while True:
+            try:
+                response = send()
+                response.raise_for_status()
+                return response
+            except httpx.HTTPError as e:
+                delay = self._retry_delay(e, attempt, retry_status)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+                attempt += 1
+
+    def upload_pdf(self, file: PdfSource) -> str:
+        """Upload `file` (a path, bytes or binary stream) and return its path on the server."""
+        file_hash = hash_pdf(file)
+        server_path = _known_server_path(self.base_url, file_hash)
+        if server_path is not None:
+            return server_path
+
+        def send():
+            with open_pdf_stream(file) as stream:
+                return self._http.post(
+                    "/api/v2/files", files={"file": (_file_name(file), stream, "application/pdf")}
+                )
+
+        server_path = self._request(send).json()["path"]
+        _remember_server_path(self.base_url, file_hash, server_path)
+        return server_path
+
+    def run_flow(self, server_path: str, num_questions: int = 5, session_id: Optional[str] = None):
+        """Run the MCQ flow on an uploaded PDF and return the flow's message content."""
+        payload = _run_payload(server_path, num_questions, session_id)
+        try:
+            response = self._request(
+                lambda: self._http.post(f"/api/v1/run/{self.flow_id}", json=payload), RUN_RETRYABLE_STATUS
+            )
+        except httpx.HTTPStatusError as e:
+            if _is_missing_file(e):
+                _forget_server_path(self.base_url, server_path)
+            raise
+        return _message_content(response.json())
+
+    def close(self):
+        self._http.close()
+
+class AsyncLangflowClient(_LangflowClientBase):
+    """`LangflowClient` for asyncio code, sharing its upload map.
+
+    Create it inside the event loop that uses it, the connection pool belongs to that loop.
+    """
+
+    def __init__(self, **settings):
+        super().__init__(**settings)
+        self._http = httpx.AsyncClient(**self._client_options)
+
+    async def _request(
+        self, send: Callable[[], Awaitable[httpx.Response]], retry_status: Tuple[int, ...] = RETRYABLE_STATUS
+    ) -> httpx.Response:
+        attempt = 0
+        while True:
+            try:
+                response = await send()
+                response.raise_for_status()
+                return response
+            except httpx.HTTPError as e:
+                delay = self._retry_delay(e, attempt, retry_status)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+                attempt += 1
+
+    async def upload_pdf(self, file: PdfSource) -> str:
+        file_hash = hash_pdf(file)
+        server_path = _known_server_path(self.base_url, file_hash)
+        if server_path is not None:
+            return server_path
+
+        async def send():
+            with open_pdf_stream(file) as stream:
+                # The async transport needs the bytes up front, it cannot read a sync stream
+                content = stream.read()
+            return await self._http.post(
+                "/api/v2/files", files={"file": (_file_name(file), content, "application/pdf")}
+            )
+
+        server_path = (await self._request(send)).json()["path"]
+        _remember_server_path(self.base_url, file_hash, server_path)
+        return server_path
+
+    async def run_flow(self, server_path: str, num_questions: int = 5, session_id: Optional[str] = None):
+        payload = _run_payload(server_path, num_questions, session_id)
+        try:
+            response = await self._request(
+                lambda: self._http.post(f"/api/v1/run/{self.flow_id}", json=payload), RUN_RETRYABLE_STATUS
+            )
+        except httpx.HTTPStatusError as e:
+            if _is_missing_file(e):
+                _forget_server_path(self.base_url, server_path)
+            raise
+        return _message_content(response.json())
+
+    async def aclose(self):
+        await self._http.aclose()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
+
+langflow_client = LangflowClient()
+
+def upload_pdf(file: PdfSource) -> str:
+    return langflow_client.upload_pdf(file)
+
+def generate_mcqs_from_langflow(
+    pdf_path: str,
+    num_questions: int = 5,
+    questions_per_run: int = LANGFLOW_QUESTIONS_PER_RUN,
+    max_concurrency: int = LANGFLOW_MAX_CONCURRENT_RUNS
+) -> List[dict]:
+    """Generate `num_questions` MCQs from an uploaded PDF as question dicts.
+
+    Large counts are split into concurrent flow runs of at most `questions_per_run`
+    questions, each in its own session. Their questions are validated, merged in
+    run order and deduplicated. Failed runs are skipped, so the list may be
+    short. Only if every run fails is the first error raised.
+    """
+    counts = split_question_count(num_questions, questions_per_run)
+    results: Dict[int, List[MCQQuestion]] = {}
+    errors = []
+
+    def run(count: int) -> List[MCQQuestion]:
+        return parse_flow_questions(langflow_client.run_flow(pdf_path, count, session_id=str(uuid.uuid4())))
 
-    response.raise_for_status()
-    data = response.json()
+    with ThreadPoolExecutor(max_workers=max(1, min(max_concurrency, len(counts)))) as pool:
+        futures = {pool.submit(run, count): i for i, count in enumerate(counts)}
+        for future in as_completed(futures):
+            i = futures[future]
+            try:
+                results[i] = future.result()
+                print(f"✓ Langflow run {i + 1}/{len(counts)}: {len(results[i])} questions")
+            except Exception as e:
+                print(f"⚠️ Langflow run {i + 1}/{len(counts)} failed: {e}")
+                errors.append(e)
 
-    mcq_output = data["outputs"][0]["outputs"][0]["results"]["message"]["data"]["content"]
+    if not results and errors:
+        raise errors[0]
 
-    return mcq_output
+    deduper = QuestionDeduper()
+    questions = [question.model_dump() for i in sorted(results) for question in results[i]]
+    questions = [question for question in questions if deduper.add(question)]
+    if deduper.duplicates:
+        print(f"🧹 Dropped {deduper.duplicates} near-duplicate questions")
+    if errors:
+        print(f"⚠️ {len(errors)} of {len(counts)} Langflow runs failed, returning {len(questions[:num_questions])} questions")
+    return questions[:num_questions]
@@ -1,62 +1,500 @@
-from typing import Dict
-from core.pdf_processor import load_and_chunk_pdf
-from core.agent import create_mcq_agent, generate_mcqs_from_chunk
+from bisect import bisect_left
+from typing import Dict, Iterator, List, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from core.pdf_processor import (
+    PdfSource, PdfTextStream, hash_pdf, load_and_chunk_pdf, pdf_size_bytes, pdf_source, validate_pdf_size
+)
+from core.agent import PROMPT_VERSION, generate_mcqs_from_chunk, generate_mcqs_from_segments, get_mcq_agent
+from core.cache import make_cache_key, result_cache
+from core.config import (
+    CHUNK_CACHE_ENABLED, CHUNK_SAMPLING, CHUNK_SAMPLING_SEED, CHUNKING_MODE, DEDUP_ENABLED, MCQ_MAX_CONCURRENCY, METRICS_FILE, OPENAI_MODEL, OPENAI_TEMPERATURE,
+    PACK_MAX_SEGMENTS, PACK_MAX_TOKENS, RESULT_CACHE_ENABLED, STREAM_PDF_ABOVE_MB, TEXT_CACHE_ENABLED, TOPUP_MAX_ROUNDS,
+    TOPUP_QUESTIONS_PER_CALL
+)
+from core.dedup import QuestionDeduper
+from core.sampling import select_chunks
+from core.telemetry import CHUNKS_PER_DOCUMENT, DOCUMENTS, span, trace, traced, write_metrics_file
 from core.tracker import tracker
 
-def generate_mcqs_from_pdf(pdf_path: str, num_questions: int = 10) -> Dict:
-    # Step 1: Load PDF and chunk it with Chonkie
-    print("\nStep 1: Loading and chunking PDF...")
-    full_text, chunks = load_and_chunk_pdf(pdf_path)
-    
-    # Step 2: Create MCQ agent
-    print("\nStep 2: Creating MCQ agent...")
-    agent = create_mcq_agent()
-    
-    # Step 3: Generate MCQs from chunks
-    print(f"\nStep 3: Generating {num_questions} MCQs...")
-    all_mcqs = []
-    
-    # Distribute questions across chunks
+def _chunk_text(chunk) -> str:
+    return chunk.text if hasattr(chunk, 'text') else str(chunk)
+
+def _chunk_tokens(chunk) -> int:
+    return chunk.token_count if hasattr(chunk, 'token_count') else len(str(chunk))
+
+def _approx_tokens(chunk) -> int:
+    # Character-mode token_count is a character count
+    if CHUNKING_MODE == "token":
+        return _chunk_tokens(chunk)
+    return len(_chunk_text(chunk)) // 4
+
+def allocate_questions(weights: List[int], num_questions: int) -> List[int]:
+    """Split `num_questions` across chunks in proportion to `weights` (largest remainder method)."""
+    total = sum(weights)
+    if total <= 0:
+        weights, total = [1] * len(weights), len(weights)
+
+    quotas = [num_questions * weight / total for weight in weights]
+    counts = [int(quota) for quota in quotas]
+    by_remainder = sorted(range(len(weights)), key=lambda i: (counts[i] - quotas[i], i))
+    for i in by_remainder[:num_questions - sum(counts)]:
+        counts[i] += 1
+    return counts
+
+def _planned_chunks(num_chunks: int, num_questions: int, allocation: Optional[List[int]] = None) -> int:
+    # How many chunks will be sent to the agent if every call returns its full count
+    if allocation is not None:
+        return sum(1 for count in allocation if count > 0)
+    questions_per_chunk = max(1, num_questions // num_chunks)
+    return min(num_chunks, -(-num_questions // questions_per_chunk))
+
+def _log_chunk_usage(index: int, usage: dict, document_hash: Optional[str], spans: Optional[List[dict]]):
+    with trace(spans), span("track", chunk_index=index):
+        tracker.log_usage(
+            input_tokens=usage.get("input_tokens", 0),
+            output_tokens=usage.get("output_tokens", 0),
+            document_hash=document_hash,
+            chunk_index=index,
+            latency_ms=usage.get("latency_ms"),
+            cached_input_tokens=usage.get("cached_input_tokens", 0)
+        )
+
+def _iter_chunk_results(
+    chunks: List,
+    num_questions: int,
+    agent,
+    max_concurrency: int,
+    use_cache: bool = True,
+    allocation: Optional[List[int]] = None,
+    document_hash: Optional[str] = None,
+    spans: Optional[List[dict]] = None,
+    chunk_indices: Optional[List[int]] = None,
+    packed_agent=None
+) -> Iterator[Tuple[int, List[dict], dict]]:
+    """Fan chunks out to the agent with at most `max_concurrency` calls in flight.
+
+    Yields `(chunk_index, mcqs, usage)` in completion order as each call returns.
+
+    Without an `allocation`, every chunk asks for `num_questions // len(chunks)`
+    (at least 1), as the serial loop did. With one, chunk i asks for
+    `allocation[i]` and zero-allocation chunks are skipped. Either way the last
+    chunk asks for whatever is still missing. Questions already requested by in-flight calls
+    count towards the target, so dispatching stops once `num_questions` is
+    covered and resumes only if a call comes back short.
+
+    With a `packed_agent`, runs of adjacent chunks totalling at most PACK_MAX_TOKENS
+    are sent together in one call, a skipped chunk or a gap in `chunk_indices`
+    ends the run. Every chunk is still yielded on its own, the call's usage on
+    the first one and zero usage on the rest.
+
+    "llm" and "track" spans are appended to `spans` when given. `chunk_indices`
+    maps positions in `chunks` to document chunk indices when only a subset is passed.
+    """
+    max_concurrency = max(1, max_concurrency)
     questions_per_chunk = max(1, num_questions // len(chunks))
+    in_flight = {}
+    collected = 0
+    next_index = 0
+    generate = traced(spans, generate_mcqs_from_chunk)
+    generate_packed = traced(spans, generate_mcqs_from_segments)
+    subset = chunk_indices is not None
+    chunk_indices = chunk_indices or list(range(len(chunks)))
+    max_segments = max(1, PACK_MAX_SEGMENTS) if packed_agent is not None else 1
+    # Top-up passes a subset, so its progress lines show document chunk numbers only
+    label = lambda position: f"{chunk_indices[position]+1}" if subset else f"{position+1}/{len(chunks)}"
+
+    with ThreadPoolExecutor(max_workers=max_concurrency) as pool:
+        while True:
+            pending = sum(count for group in in_flight.values() for _, count in group)
+            remaining = num_questions - collected - pending
+
+            while next_index < len(chunks) and len(in_flight) < max_concurrency and remaining > 0:
+                group = []
+                group_tokens = 0
+                while next_index < len(chunks) and remaining > 0 and len(group) < max_segments:
+                    # For last chunk, generate remaining questions
+                    if next_index == len(chunks) - 1:
+                        count = remaining
+                    elif allocation is not None:
+                        count = min(allocation[next_index], remaining)
+                    else:
+                        count = min(questions_per_chunk, remaining)
+
+                    if count == 0:
+                        # Only adjacent chunks are packed, a skipped one ends the group
+                        if group:
+                            break
+                        next_index += 1
+                        continue
+
+                    tokens = _approx_tokens(chunks[next_index])
+                    if group and (
+                        group_tokens + tokens > PACK_MAX_TOKENS
+                        or chunk_indices[next_index] != chunk_indices[group[-1][0]] + 1
+                    ):
+                        break
+                    group.append((next_index, count))
+                    group_tokens += tokens
+                    next_index += 1
+                    remaining -= count
+
+                if not group:
+                    continue
+
+                if len(group) == 1:
+                    position, count = group[0]
+                    print(f"Processing chunk {label(position)}...")
+                    future = pool.submit(generate, _chunk_text(chunks[position]), count, agent, use_cache)
+                else:
+                    print(f"Processing chunks {chunk_indices[group[0][0]]+1}-{chunk_indices[group[-1][0]]+1} in one call...")
+                    future = pool.submit(
+                        generate_packed,
+                        [_chunk_text(chunks[position]) for position, _ in group],
+                        [count for _, count in group],
+                        packed_agent,
+                        use_cache
+                    )
+                in_flight[future] = group
+
+            if not in_flight:
+                break
+
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                group = in_flight.pop(future)
+                if len(group) == 1:
+                    mcqs, usage = future.result()
+                    batches = [mcqs]
+                else:
+                    batches, usage = future.result()
+
+                for i, ((position, _), mcqs) in enumerate(zip(group, batches)):
+                    index = chunk_indices[position]
+                    chunk_usage = usage if i == 0 else {"input_tokens": 0, "output_tokens": 0, "packed": True}
+                    _log_chunk_usage(index, chunk_usage, document_hash, spans)
+                    collected += len(mcqs)
+                    yield index, mcqs, chunk_usage
+
+def _page_targets(num_pages: int, num_questions: int) -> List[int]:
+    # Questions per page, spread evenly over the document by page position
+    counts = [0] * num_pages
+    for i in range(num_questions):
+        counts[int((i + 0.5) * num_pages / num_questions)] += 1
+    return counts
+
+def _iter_streamed_chunk_results(
+    stream: PdfTextStream,
+    num_questions: int,
+    agent,
+    max_concurrency: int,
+    use_cache: bool = True,
+    document_hash: Optional[str] = None,
+    spans: Optional[List[dict]] = None
+) -> Iterator[Tuple[int, List[dict], dict]]:
+    """`_iter_chunk_results` for a `PdfTextStream`: each chunk is sent as soon as it is produced.
+
+    Questions are targeted at pages spread evenly over the document, and a chunk asks
+    for the targets of the pages that start inside it plus whatever earlier calls
+    came back short of. Only the texts of the (at most `max_concurrency`) chunks in
+    flight are held, whatever the document size.
+    """
+    max_concurrency = max(1, max_concurrency)
+    page_targets = _page_targets(stream.num_pages, num_questions) if stream.num_pages else []
+    next_page = 0
+    pages_assigned = 0
+    short = 0
+    in_flight = {}
+    generate = traced(spans, generate_mcqs_from_chunk)
+    chunks = stream.chunks()
+
+    def collect(done):
+        nonlocal short
+        for future in done:
+            index, count = in_flight.pop(future)
+            mcqs, usage = future.result()
+            _log_chunk_usage(index, usage, document_hash, spans)
+            short += max(0, count - len(mcqs))
+            yield index, mcqs, usage
+
+    with ThreadPoolExecutor(max_workers=max_concurrency) as pool:
+        while True:
+            with trace(spans):
+                chunk = next(chunks, None)
+            if chunk is None:
+                break
+            index = stream.num_chunks - 1
+
+            # Targets of pages without text roll over to the next page that has some
+            count, short = short, 0
+            while pages_assigned < len(stream.page_offsets) and stream.page_offsets[pages_assigned] < chunk.end_index:
+                page_num = stream.page_numbers[pages_assigned]
+                count += sum(page_targets[next_page:page_num + 1])
+                next_page = page_num + 1
+                pages_assigned += 1
+
+            if count > 0:
+                print(f"Processing chunk {index + 1}...")
+                in_flight[pool.submit(generate, chunk.text, count, agent, use_cache)] = (index, count)
+
+            yield from collect([future for future in in_flight if future.done()])
+            while len(in_flight) >= max_concurrency:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                yield from collect(done)
+
+        while in_flight:
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            yield from collect(done)
+
+def _top_up_targets(
+    weights: List[int],
+    returned: Dict[int, int],
+    shortfall: int,
+    questions_per_call: int
+) -> List[Tuple[int, int]]:
+    """Pick the fewest chunks that can cover `shortfall` and split it across them by `weights`.
+
+    Chunks never sent come first, farthest from any chunk already used so the
+    extra questions widen coverage, then ones whose call failed, then the ones
+    that returned the fewest questions. Returns `(chunk_index, count)` pairs.
+    """
+    used = sorted(i for i, count in returned.items() if count > 0)
+
+    def distance_to_used(i: int) -> int:
+        position = bisect_left(used, i)
+        neighbours = used[max(0, position - 1):position + 1]
+        return min((abs(i - j) for j in neighbours), default=len(weights))
+
+    order = sorted(
+        range(len(weights)),
+        key=lambda i: (i in returned, returned.get(i, 0), -distance_to_used(i), i)
+    )
+    num_calls = min(len(weights), -(-shortfall // max(1, questions_per_call)))
+    targets = sorted(order[:num_calls])
+    counts = allocate_questions([weights[i] for i in targets], shortfall)
+    return [(index, count) for index, count in zip(targets, counts) if count > 0]
+
+def _result_cache_key(pdf_hash: str, num_questions: int) -> str:
+    return make_cache_key(
+        pdf_sha256=pdf_hash,
+        num_questions=num_questions,
+        model=OPENAI_MODEL,
+        temperature=OPENAI_TEMPERATURE,
+        prompt_version=PROMPT_VERSION,
+        chunk_sampling=CHUNK_SAMPLING,
+        chunk_sampling_seed=CHUNK_SAMPLING_SEED
+    )
+
+def stream_mcqs_from_pdf(
+    pdf_path: PdfSource,
+    num_questions: int = 10,
+    max_concurrency: int = MCQ_MAX_CONCURRENCY,
+    use_cache: bool = RESULT_CACHE_ENABLED,
+    use_chunk_cache: bool = CHUNK_CACHE_ENABLED,
+    use_text_cache: bool = TEXT_CACHE_ENABLED,
+    regenerate: bool = False
+) -> Iterator[Dict]:
+    """Generate MCQs as a stream of events instead of one final result.
+
+    Events are dicts with a `type` key:
+    - "start": `num_chunks`, `planned_chunks` (calls expected) and `num_questions` once the PDF is chunked
+    - "question": a validated `question` dict and its `chunk_index`, as soon as its chunk returns
+    - "progress": `chunk_index`, `completed_chunks`, `planned_chunks`, `num_chunks`, `questions_ready` and the call's `usage`
+    - "done": the same `result` dict `generate_mcqs_from_pdf` returns, questions in chunk order
+
+    Near-duplicate questions are dropped before they are streamed, and when failed
+    calls or dropped duplicates leave the set short, up to TOPUP_MAX_ROUNDS rounds
+    of top-up calls ask the fewest chunks needed for exactly the missing count.
+
+    Freshly generated results carry the run's stage spans in `metadata["spans"]`.
+
+    `pdf_path` may also be the PDF's bytes, a memoryview over them or a binary
+    stream, which are processed in memory without touching the disk.
+
+    `use_cache`, `use_chunk_cache` and `use_text_cache` switch the result, chunk
+    and extracted-text caches individually. `regenerate=True` asks for new
+    questions: cached results and chunk questions are not read, but the new ones
+    replace them.
+    """
+    # Step 0: Return a previous result for the same PDF and parameters
+    cache_key = None
+    pdf_path = pdf_source(pdf_path)
+    pdf_hash = hash_pdf(pdf_path)
+    if regenerate:
+        use_chunk_cache = False
+    if use_cache:
+        cache_key = _result_cache_key(pdf_hash, num_questions)
+    if use_cache and not regenerate:
+        cached = result_cache.get(cache_key)
+        tracker.log_cache("result", hit=cached is not None)
+        if cached is not None:
+            print(f"\n✅ Loaded {len(cached['questions'])} questions from cache!")
+            DOCUMENTS.inc(source="cache")
+            num_chunks = cached["metadata"]["num_chunks"]
+            yield {"type": "start", "num_chunks": num_chunks, "planned_chunks": 0, "num_questions": num_questions}
+            for question in cached["questions"]:
+                yield {"type": "question", "question": question, "chunk_index": None}
+            yield {"type": "done", "result": cached}
+            return
+
+    # Spans are collected in one list, the trace is only entered around synchronous work
+    # since this generator may be resumed from different threads between yields
+    spans = []
+    streaming = pdf_size_bytes(pdf_path) > STREAM_PDF_ABOVE_MB * 1024 * 1024
+
+    # Step 1: Load PDF and chunk it with Chonkie, large PDFs are only opened here
+    # and extracted, chunked and sent page by page in step 3
+    if streaming:
+        print("\nStep 1: Opening PDF for streaming...")
+        with trace(spans), span("validate"):
+            validate_pdf_size(pdf_path)
+        stream = PdfTextStream(pdf_path)
+        chunks = None
+    else:
+        print("\nStep 1: Loading and chunking PDF...")
+        with trace(spans):
+            full_text, chunks = load_and_chunk_pdf(pdf_path, use_cache=use_text_cache, pdf_hash=pdf_hash)
+        CHUNKS_PER_DOCUMENT.observe(len(chunks))
+
+    def num_chunks() -> int:
+        return stream.num_chunks if streaming else len(chunks)
     
-    for i, chunk in enumerate(chunks):
-        # For last chunk, generate remaining questions
-        if i == len(chunks) - 1:
-            remaining = num_questions - len(all_mcqs)
-            questions_per_chunk = max(1, remaining)
-
-        # Extract text from chunk
-        chunk_text = chunk.text if hasattr(chunk, 'text') else str(chunk)
-        print(f"Processing chunk {i+1}/{len(chunks)}...")
-        
-        # Get MCQs and Usage Data
-        mcqs, usage = generate_mcqs_from_chunk(
-            chunk_text,
-            min(questions_per_chunk, num_questions - len(all_mcqs)),
-            agent
+    # Step 2: Get the shared MCQ agent
+    print("\nStep 2: Getting MCQ agent...")
+    agent = get_mcq_agent()
+    packed_agent = get_mcq_agent(packed=True) if PACK_MAX_TOKENS > 0 else None
+    
+    # Step 3: Generate MCQs from chunks, streaming each chunk's questions as it completes.
+    # Token-budgeted chunks get questions in proportion to their token counts
+    print(f"\nStep 3: Generating {num_questions} MCQs (concurrency={max_concurrency})...")
+    if streaming:
+        planned_chunks = min(num_questions, stream.num_pages)
+        batches = _iter_streamed_chunk_results(
+            stream, num_questions, agent, max_concurrency, use_chunk_cache, document_hash=pdf_hash, spans=spans
         )
-        
-        tracker.log_usage(
-            input_tokens=usage.get("input_tokens", 0), 
-            output_tokens=usage.get("output_tokens", 0)
+    else:
+        allocation = None
+        if num_questions < len(chunks) and CHUNK_SAMPLING != "sequential":
+            # Fewer questions than chunks: one question each from chunks spread over the whole document
+            selected = set(select_chunks(
+                [_chunk_text(chunk) for chunk in chunks], num_questions, CHUNK_SAMPLING, CHUNK_SAMPLING_SEED
+            ))
+            allocation = [1 if i in selected else 0 for i in range(len(chunks))]
+            print(f"Sampling {num_questions} of {len(chunks)} chunks ({CHUNK_SAMPLING})")
+        elif CHUNKING_MODE == "token":
+            allocation = allocate_questions([_chunk_tokens(chunk) for chunk in chunks], num_questions)
+        planned_chunks = _planned_chunks(len(chunks), num_questions, allocation)
+        batches = _iter_chunk_results(
+            chunks, num_questions, agent, max_concurrency, use_chunk_cache, allocation,
+            document_hash=pdf_hash, spans=spans, packed_agent=packed_agent
         )
-        
-        all_mcqs.extend(mcqs)
-        
-        if len(all_mcqs) >= num_questions:
-            break
+    yield {
+        "type": "start",
+        # Not known up front when streaming
+        "num_chunks": None if streaming else len(chunks),
+        "planned_chunks": planned_chunks,
+        "num_questions": num_questions
+    }
+
+    results = {}
+    returned = {}
+    deduper = QuestionDeduper() if DEDUP_ENABLED else None
+    questions_ready = 0
+    completed_calls = 0
+    topup_calls = 0
+    for round_number in range(TOPUP_MAX_ROUNDS + 1):
+        if round_number > 0:
+            # Step 4: Ask only the chunks needed to replace failed calls and dropped duplicates
+            shortfall = num_questions - questions_ready
+            if shortfall <= 0 or num_chunks() == 0:
+                break
+            if streaming:
+                weights = [token_count for _, _, token_count in stream.chunk_offsets]
+            else:
+                weights = [_chunk_tokens(chunk) for chunk in chunks]
+            targets = _top_up_targets(
+                weights, returned, shortfall, max(TOPUP_QUESTIONS_PER_CALL, -(-num_questions // num_chunks()))
+            )
+            indices = [index for index, _ in targets]
+            # A chunk that already answered would get the same questions back from the chunk cache
+            fresh = all(returned.get(index, 0) == 0 for index in indices)
+            print(f"\n🔁 Top-up {round_number}: {shortfall} questions from {len(targets)} chunk(s)...")
+            topup_calls += len(targets)
+            planned_chunks += len(targets)
+            # A streamed document re-extracts just the pages of the chunks it needs
+            topup_chunks = [stream.chunk_at(index) if streaming else chunks[index] for index in indices]
+            batches = _iter_chunk_results(
+                topup_chunks, shortfall, agent, max_concurrency, use_chunk_cache and fresh,
+                [count for _, count in targets], document_hash=pdf_hash, spans=spans, chunk_indices=indices,
+                packed_agent=packed_agent
+            )
+
+        for index, mcqs, usage in batches:
+            returned[index] = returned.get(index, 0) + len(mcqs)
+            kept = [question for question in mcqs if deduper is None or deduper.add(question)]
+            results.setdefault(index, []).extend(kept)
+            for question in kept:
+                yield {"type": "question", "question": question, "chunk_index": index}
+            questions_ready += len(kept)
+            completed_calls += 1
+            yield {
+                "type": "progress",
+                "chunk_index": index,
+                "completed_chunks": completed_calls,
+                "planned_chunks": max(planned_chunks, completed_calls),
+                "num_chunks": num_chunks(),
+                "questions_ready": questions_ready,
+                "usage": usage
+            }
+
+    if streaming:
+        CHUNKS_PER_DOCUMENT.observe(stream.num_chunks)
+
+    all_mcqs = []
+    for index in sorted(results):
+        all_mcqs.extend(results[index])
+    if deduper is not None and deduper.duplicates:
+        print(f"🧹 Dropped {deduper.duplicates} near-duplicate questions")
     
     # Log document completion
-    tracker.log_usage(0, 0, is_new_document=True)
+    with trace(spans), span("track", document=True):
+        tracker.log_usage(0, 0, is_new_document=True, document_hash=pdf_hash)
+    DOCUMENTS.inc(source="generated")
 
     result = {
         "questions": all_mcqs[:num_questions],
         "metadata": {
-            "num_chunks": len(chunks),
+            "num_chunks": num_chunks(),
             "total_questions": len(all_mcqs[:num_questions]),
-            "text_length": len(full_text)
+            "text_length": stream.text_length if streaming else len(full_text),
+            "duplicates_removed": deduper.duplicates if deduper is not None else 0,
+            "topup_calls": topup_calls
         }
     }
     
+    # Only cache complete results so a partial run gets retried next time
+    if cache_key and len(result["questions"]) >= num_questions:
+        result_cache.set(cache_key, result)
+
+    # Spans describe this run only, so they stay out of the cached copy
+    spans.sort(key=lambda recorded: recorded["start"])
+    result["metadata"] = {**result["metadata"], "spans": spans}
+    if METRICS_FILE:
+        write_metrics_file(METRICS_FILE)
+
     print(f"\n✅ Generated {len(result['questions'])} questions!")
-    return result
+    yield {"type": "done", "result": result}
+
+def generate_mcqs_from_pdf(
+    pdf_path: PdfSource,
+    num_questions: int = 10,
+    max_concurrency: int = MCQ_MAX_CONCURRENCY,
+    use_cache: bool = RESULT_CACHE_ENABLED,
+    use_chunk_cache: bool = CHUNK_CACHE_ENABLED,
+    use_text_cache: bool = TEXT_CACHE_ENABLED,
+    regenerate: bool = False
+) -> Dict:
+    for event in stream_mcqs_from_pdf(
+        pdf_path, num_questions, max_concurrency, use_cache, use_chunk_cache, use_text_cache, regenerate
+    ):
+        if event["type"] == "done":
+            return event["result"]